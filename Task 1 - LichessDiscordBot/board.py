@@ -1,122 +1,210 @@
+import hashlib
+import itertools
+import math
+import os
 from io import BytesIO
+from typing import BinaryIO, Optional
 
 import chess
 import discord
-import matplotlib.patches as patches
-import matplotlib.pyplot as plt
-from PIL import Image
 
+from gif import GifEncoder
+from renderer import get_renderer, render_key
 
-def generate_board(moves: list[str]) -> str:
-    board = chess.Board()
-    if moves is not None:
-        for move in moves.split(" "):
-            board.push(chess.Move.from_uci(move))
-    fig, ax = plt.subplots()
-    ax.set_xlim([0, 8])
-    ax.set_ylim([0, 8])
-    ax.set_aspect("equal")
-    ax.set_axis_off()
-    for i in range(8):
-        for j in range(8):
-            if (i + j) % 2 == 0:
-                color = "white"
-            else:
-                color = "gray"
-            ax.add_patch(patches.Rectangle((i, j), 1, 1, color=color))
-    for i in range(8):
-        for j in range(8):
-            piece = board.piece_at(chess.square(i, j))
-            if piece is not None:
-                ax.text(
-                    i + 0.5,
-                    j + 0.5,
-                    chess.UNICODE_PIECE_SYMBOLS[piece.symbol()],
-                    fontsize=30,
-                    ha="center",
-                    va="center",
-                )
-        ax.text(i + 0.5, -0.5, chess.FILE_NAMES[i], ha="center", va="center")
-        ax.text(
-            -0.5,
-            i + 0.5,
-            chess.RANK_NAMES[i],
-            ha="center",
+GIF_FRAME_STRIDE = int(os.getenv("GIF_FRAME_STRIDE", 1))
+GIF_MAX_FRAMES = int(os.getenv("GIF_MAX_FRAMES", 300))
+
+
+class LiveBoard:
+    """
+    Position of a streamed game that only applies the moves added since the
+    previous update.
+
+    The board is rebuilt from the initial position only when the new move
+    list does not extend the previous one (takebacks or mismatches).
+    """
+
+    def __init__(self, initial_fen: str = "startpos", chess960: bool = False):
+        self.initial_fen = (
+            chess.STARTING_FEN if initial_fen in (None, "startpos") else initial_fen
         )
-    figure = fig.get_figure()
-    buf = BytesIO()
-    figure.savefig(buf, format="png")
-    buf.seek(0)
-    image = discord.File(buf, filename="board.png")
-    buf.close()
-    plt.clf()
-    embed = discord.Embed(title="Game in progress", color=discord.Color.green())
+        self.chess960 = chess960
+        self.reset()
+
+    def reset(self) -> None:
+        self.board = chess.Board(self.initial_fen, chess960=self.chess960)
+        self.moves = ""
+
+    def update(self, moves: Optional[str]) -> chess.Board:
+        """
+        Bring the board up to date with the move list of a game state event.
+
+        Args:
+        - moves: space separated uci moves from the start of the game.
+
+        Returns:
+        - the updated board.
+        """
+        moves = moves or ""
+        known = len(self.moves)
+        if moves.startswith(self.moves) and (
+            known == 0 or len(moves) == known or moves[known] == " "
+        ):
+            new_moves = moves[known:].split()
+        else:
+            self.reset()
+            new_moves = moves.split()
+        try:
+            for move in new_moves:
+                self.board.push_uci(move)
+        except ValueError:
+            # Rebuild from the initial position, keeping the legal part of a
+            # move list that is itself broken.
+            self.reset()
+            applied = []
+            for move in moves.split():
+                try:
+                    self.board.push_uci(move)
+                except ValueError:
+                    print(f"Illegal move {move} after {' '.join(applied)!r}")
+                    break
+                applied.append(move)
+            moves = " ".join(applied)
+        self.moves = moves
+        return self.board
+
+    def parse_move(self, text: str) -> chess.Move:
+        """
+        Parse a move in UCI or SAN notation in the current position.
+
+        Args:
+        - text: the move, e.g. "g1f3" or "Nf3".
+
+        Returns:
+        - the legal move.
+
+        Raises:
+        - ValueError if the move is malformed, ambiguous or illegal.
+        """
+        try:
+            move = self.board.parse_uci(text)
+        except chess.InvalidMoveError:
+            move = self.board.parse_san(text)
+        if not move:
+            raise chess.IllegalMoveError(f"null move in {self.board.fen()}")
+        return move
+
+
+def board_key(board_fen: str) -> str:
+    return f"board:{render_key()}:{board_fen}"
+
+
+def render_board(board_fen: str) -> bytes:
+    return get_renderer().render_png(chess.BaseBoard(board_fen))
+
+
+def board_message(
+    png: bytes, embed: Optional[discord.Embed] = None
+) -> tuple[discord.Embed, discord.File]:
+    image = discord.File(BytesIO(png), filename="board.png")
+    if embed is None:
+        embed = discord.Embed(title="Game in progress", color=discord.Color.green())
     embed.set_image(url="attachment://board.png")
     return embed, image
 
 
-def create_board_frame(board: chess.Board) -> Image.Image:
-    fig, ax = plt.subplots()
-    ax.set_xlim([0, 8])
-    ax.set_ylim([0, 8])
-    ax.set_aspect("equal")
-    ax.set_axis_off()
-    for i in range(8):
-        for j in range(8):
-            if (i + j) % 2 == 0:
-                color = "white"
-            else:
-                color = "gray"
-            ax.add_patch(patches.Rectangle((i, j), 1, 1, color=color))
-    for i in range(8):
-        for j in range(8):
-            piece = board.piece_at(chess.square(i, j))
-            if piece is not None:
-                ax.text(
-                    i + 0.5,
-                    j + 0.5,
-                    chess.UNICODE_PIECE_SYMBOLS[piece.symbol()],
-                    fontsize=30,
-                    ha="center",
-                    va="center",
-                )
-        ax.text(i + 0.5, -0.5, chess.FILE_NAMES[i], ha="center", va="center")
-        ax.text(
-            -0.5,
-            i + 0.5,
-            chess.RANK_NAMES[i],
-            ha="center",
-        )
-    figure = fig.get_figure()
-    buf = BytesIO()
-    figure.savefig(buf, format="png")
-    buf.seek(0)
-    plt.clf()
-    return Image.open(buf)
+def board_text(board: chess.Board) -> str:
+    """
+    Compact text board for an embed description, white at the bottom.
+
+    Args:
+    - board: the position.
+
+    Returns:
+    - a code block with the board, followed by the side to move and the
+      last move.
+    """
+    rows = []
+    for rank in range(7, -1, -1):
+        pieces = [board.piece_at(chess.square(file, rank)) for file in range(8)]
+        cells = [piece.unicode_symbol() if piece else "·" for piece in pieces]
+        rows.append(f"{rank + 1} {' '.join(cells)}")
+    rows.append("  a b c d e f g h")
+    status = "White" if board.turn == chess.WHITE else "Black"
+    status += " to move"
+    if board.is_check():
+        status += ", check"
+    if board.move_stack:
+        status += f" · last move {board.peek().uci()}"
+    return "```\n" + "\n".join(rows) + "\n```\n" + status
 
 
-def frame_generator(moves: list[str]):
+def frame_generator(moves: list[str], stride: int = 1):
+    renderer = get_renderer()
     board = chess.Board()
-    yield create_board_frame(board)
-    for move in moves:
+    shown = board.piece_map()
+    yield renderer.render_frame(board), None
+    for ply, move in enumerate(moves, 1):
         board.push_san(move)
-        yield create_board_frame(board)
+        if ply % stride == 0 or ply == len(moves):
+            before, shown = shown, board.piece_map()
+            yield renderer.render_frame(board), renderer.changed_box(before, shown)
 
 
-def create_board_gif(moves: list[str]) -> tuple[discord.Embed, discord.File]:
+def write_replay(
+    fp: BinaryIO,
+    moves: str,
+    stride: int = GIF_FRAME_STRIDE,
+    max_frames: int = GIF_MAX_FRAMES,
+) -> None:
+    """
+    Render and encode a replay one frame at a time straight into fp.
+
+    Only the frame being encoded and the previous one are held in memory.
+
+    Args:
+    - fp: binary file object the GIF is written to.
+    - moves: space separated san moves from the start of the game.
+    - stride: number of plies per frame, raised when the game would need
+      more than max_frames frames. The final position is always shown.
+    - max_frames: hard cap on the number of frames.
+    """
     moves = moves.split()
-    frames = list(frame_generator(moves))
+    stride = max(stride, 1, math.ceil(len(moves) / max(max_frames - 1, 1)))
+    encoder = GifEncoder(fp, get_renderer().palette, duration=500)
+    for frame, box in itertools.islice(frame_generator(moves, stride), max_frames):
+        encoder.add_frame(frame, box)
+    encoder.close()
+
+
+def replay_options() -> str:
+    return f"{render_key()}:{GIF_FRAME_STRIDE}:{GIF_MAX_FRAMES}"
+
+
+def replay_key(moves: str) -> str:
+    digest = hashlib.sha1(moves.encode("utf-8")).hexdigest()
+    return f"replay:{replay_options()}:{digest}"
+
+
+def render_replay(moves: str) -> bytes:
     gif = BytesIO()
-    frames[0].save(
-        gif,
-        save_all=True,
-        append_images=frames[1:],
-        duration=500,
-        loop=0,
-        format="GIF",
-    )
+    write_replay(gif, moves)
+    return gif.getvalue()
+
+
+def replay_message(gif: bytes) -> tuple[discord.Embed, discord.File]:
     embed = discord.Embed(description="Match Replay", color=discord.Color.green())
-    gif.seek(0)
-    image = discord.File(gif, filename="replay.gif")
+    image = discord.File(BytesIO(gif), filename="replay.gif")
     embed.set_image(url="attachment://replay.gif")
     return embed, image
+
+
+def replay_players(game: dict) -> str:
+    names = []
+    for color in ("white", "black"):
+        player = game["players"][color]
+        if player.get("aiLevel"):
+            names.append(f"AI lvl {player['aiLevel']}")
+        else:
+            names.append(player["user"]["name"])
+    return " vs ".join(names)
@@ -1,10 +1,16 @@
 import discord
 from discord.ext import commands
+from typing import Optional
 from commands import Commands
 
 
-class Chessify(commands.Bot):
-    def __init__(self):
+class Chessify(commands.AutoShardedBot):
+    def __init__(
+        self,
+        shard_ids: Optional[list[int]] = None,
+        shard_count: Optional[int] = None,
+        sync_commands: bool = True,
+    ):
         intents = discord.Intents.default()
         intents = discord.Intents.default()
         intents.typing = False
@@ -14,10 +20,17 @@ class Chessify(commands.Bot):
         intents.guilds = True
         intents.dm_messages = True
         intents.message_content = True
-        super().__init__(command_prefix="/", intents=intents)
+        super().__init__(
+            command_prefix="/",
+            intents=intents,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
+        )
+        self.sync_commands = sync_commands
 
     async def setup_hook(self):
         await self.add_cog(Commands(self))
 
     async def on_ready(self):
-        await self.tree.sync()
+        if self.sync_commands:
+            await self.tree.sync()
@@ -0,0 +1,124 @@
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+import redis.asyncio as aioredis
+
+import store
+
+RENDER_CACHE_BYTES = int(os.getenv("RENDER_CACHE_BYTES", 64 * 1024 * 1024))
+RENDER_CACHE_REDIS_TTL = int(os.getenv("RENDER_CACHE_REDIS_TTL", 0))
+
+
+class LRUCache:
+    """In-process cache of bytes values evicting the least recently used first."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.items = OrderedDict()
+
+    def get(self, key: str) -> Optional[bytes]:
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        if len(value) > self.max_bytes:
+            return
+        if key in self.items:
+            self.size -= len(self.items.pop(key))
+        self.items[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.size -= len(evicted)
+
+
+class RenderCache:
+    """
+    Two tier cache of rendered images: an in-process LRU bounded by bytes and
+    an optional Redis tier shared between bot processes.
+
+    Concurrent misses on the same key share a single render.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = RENDER_CACHE_BYTES,
+        redis_ttl: int = RENDER_CACHE_REDIS_TTL,
+        redis: Optional[aioredis.Redis] = None,
+    ):
+        self.memory = LRUCache(max_bytes)
+        self.redis_ttl = redis_ttl
+        self.redis = redis
+        if redis is None and redis_ttl > 0:
+            self.redis = store.r
+        self.inflight = {}
+        self.stats = {"memory_hits": 0, "redis_hits": 0, "misses": 0}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+        if self.redis is not None:
+            try:
+                value = await self.redis.get(f"render:{key}")
+            except aioredis.RedisError as e:
+                print(e)
+            if value is not None:
+                self.stats["redis_hits"] += 1
+                self.memory.set(key, value)
+                return value
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, value: bytes) -> None:
+        self.memory.set(key, value)
+        if self.redis is not None:
+            try:
+                await self.redis.set(f"render:{key}", value, ex=self.redis_ttl)
+            except aioredis.RedisError as e:
+                print(e)
+
+    async def get_or_render(
+        self, key: str, render: Callable[[], Awaitable[bytes]]
+    ) -> bytes:
+        """
+        Get a cached render, rendering and storing it on a miss.
+
+        Args:
+        - key: cache key including everything that affects the output.
+        - render: coroutine function producing the value.
+
+        Returns:
+        - the cached or freshly rendered value.
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+        task = self.inflight.get(key)
+        if task is None:
+            # The miss runs in its own task, so a waiter being cancelled does
+            # not cancel it for the others.
+            task = asyncio.create_task(self.fill(key, render))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.done(key, task))
+        return await asyncio.shield(task)
+
+    async def fill(self, key: str, render: Callable[[], Awaitable[bytes]]) -> bytes:
+        value = await self.get(key)
+        if value is None:
+            value = await render()
+            await self.set(key, value)
+        return value
+
+    def done(self, key: str, task: asyncio.Task) -> None:
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            task.exception()
@@ -1,94 +1,116 @@
 import discord
 from discord.ext import commands
-from typing import Optional
-import json
+from typing import Literal, Optional
 import discord.ext.commands
 import discord.ext.commands.context as context
-import redis
-import berserk
-import lichess_client
 import asyncio
-from board import generate_board, create_board_gif
-import time
-import async_timeout
+import chess
+from board import replay_message, replay_players
+from hub import STREAM_BOARD_MODE
+from supervisor import StreamLimitReached, StreamSupervisor
+from render_service import RenderService
+from replay_cache import ReplayCache
+import store
+from history import HistoryStore
+from positions import PositionIndex
+from jobs import JobQueue
+from models.data import Challenge, Job, JobWaiter
+from lichess import LichessClient, RateLimited
+from events import EventDispatcher, EventRouter
+from engine import EnginePool
 
 import discord.ext
 
-r = redis.Redis(host="localhost", port=6379, db=0)
 
+async def replied_challenge(ctx: context) -> Optional[Challenge]:
+    """
+    Look up the challenge addressed to the author of a reply.
 
-def get_auth(user_id: int) -> tuple:
-    data = r.get(f"auth_{user_id}")
-    if data is None:
-        return None, None
-    data = json.loads(data.decode("utf-8"))
-    return data["token"], data["lichess_username"]
+    Args:
+    - ctx: context of the reply to a challenge message.
 
+    Returns:
+    - the challenge, or None if the message is not a reply to a pending
+      challenge of the author.
+    """
+    if ctx.message.reference is None:
+        return None
+    challenge = await store.get_challenge(ctx.message.reference.message_id)
+    if challenge is None or challenge.opponent_id != ctx.author.id:
+        return None
+    return challenge
 
-async def stream_game(
-    ctx: context, game_id: str, client: lichess_client.APIClient
-) -> None:
-    embed = discord.Embed(title="Game in progress")
-    message = await ctx.send(embed=embed)
-    async for event in client.boards.stream_game_state(game_id):
-        print(event.entity.content)
-        event = json.loads(event.entity.content)
-        if event["type"] == "gameFull":
-            white = event["white"].get("name") or f"AI lvl {event['white']['aiLevel']}"
-            black = event["black"].get("name") or f"AI lvl {event['black']['aiLevel']}"
-            await ctx.send(f"White: {white}\nBlack: {black}")
-        if event.get("status") in {"mate", "draw", "resign"}:
-            result = f"Game over! {event['status'].capitalize()}."
-            if event.get("winner"):
-                result += f" Winner: {event['winner']}."
-            embed = discord.Embed(title=result)
-            await message.edit(embed=embed)
-            break
-        elif event.get("rematch", None):
-            embed = discord.Embed(
-                title="Rematch!",
-                description="Join the new game!",
-                url=f"https://lichess.org/{event['rematch']}",
-            )
-            await message.edit(embed=embed)
-            break
-        moves = event.get("moves", None)
-        board, image = generate_board(moves)
-        await message.edit(embed=board, attachments=[image])
 
+async def send_rate_limited(ctx: context) -> None:
+    """Tell the author that Lichess requests are being rate limited."""
+    await ctx.send(
+        embed=discord.Embed(
+            title="Lichess Is Busy",
+            description="Too many requests were sent to Lichess. Please try again in a minute.",
+            color=discord.Color.red(),
+        )
+    )
 
-async def stream_events(
-    ctx: context, client: lichess_client.APIClient, opponent: str, opponent_id: str
-) -> None:
 
-    try:
-        with async_timeout.timeout(5):
-            async for event in client.boards.stream_incoming_events():
-                print(event)
-                event = json.loads(event.entity.content)
-    except asyncio.TimeoutError:
-        if event["type"] == "gameStart" and event["game"]["opponent"]["id"] == opponent:
-            print(opponent_id, event["game"]["id"])
-            r.set(f"game_{ctx.author.id}", event["game"]["id"])
-            r.set(f"game_{opponent_id}", event["game"]["id"])
-            await ctx.send("Game started!")
-            await ctx.send(f"Game ID: {event['game']['id']}")
-            await ctx.send(f"{ctx.author.mention} playing as {event['game']['color']}")
-            asyncio.create_task(stream_game(ctx, event["game"]["id"], client))
-        else:
-            await ctx.send("Game not found")
+async def stream_duel(
+    ctx: context,
+    events: EventDispatcher,
+    started: asyncio.Future,
+    token: str,
+    opponent_id: int,
+    supervisor: StreamSupervisor,
+) -> None:
+    event = await events.wait_for(started)
+    if event is None:
+        await ctx.send("Game not found")
+        return
+    game = event["game"]
+    await store.set_game(game["id"], ctx.author.id, opponent_id)
+    await ctx.send("Game started!")
+    await ctx.send(f"Game ID: {game['id']}")
+    await ctx.send(f"{ctx.author.mention} playing as {game['color']}")
+    await supervisor.start_stream(game["id"], ctx.author.id, token, ctx)
 
 
 class Commands(commands.Cog, name="Chessify Commands"):
     def __init__(self, bot: discord.ext.commands.Bot):
         self.bot = bot
+        self.render_service = RenderService()
+        self.replay_cache = ReplayCache()
+        self.jobs = JobQueue()
+        self.history = HistoryStore()
+        self.positions = PositionIndex()
+        self.lichess = LichessClient()
+        self.events = EventRouter(self.lichess)
+        self.engines = EnginePool()
+        self.supervisor = StreamSupervisor(
+            bot, self.lichess, self.render_service, self.engines
+        )
+
+    async def cog_load(self):
+        self.render_service.start()
+        await self.lichess.start()
+        await self.engines.start()
+        self.supervisor.spawn(store.watch_auth())
+
+    async def cog_unload(self):
+        await self.supervisor.close()
+        self.events.close()
+        self.render_service.close()
+        await self.engines.close()
+        await self.lichess.close()
+        await store.close()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        self.supervisor.start()
 
     @commands.hybrid_command(name="login")
     async def login(self, ctx: context):
         """Connect your Lichess account to use the bot"""
-        token, username = get_auth(ctx.author.id)
-        if token is not None:
-            await ctx.send(f"Already logged in as {username}")
+        auth = await store.get_auth(ctx.author.id)
+        if auth is not None:
+            await ctx.send(f"Already logged in as {auth.lichess_username}")
             return
         await ctx.send(
             embed=discord.Embed(
@@ -105,8 +127,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
     @commands.hybrid_command(name="profile")
     async def profile(self, ctx: context):
         """View your Lichess profile information"""
-        token, _ = get_auth(ctx.author.id)
-        if token is None:
+        auth = await store.get_auth(ctx.author.id)
+        if auth is None:
             await ctx.respond(
                 embed=discord.Embed(
                     title="Not Logged In",
@@ -116,9 +138,7 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 ephemeral=True,
             )
             return
-        session = berserk.TokenSession(token)
-        client = berserk.Client(session)
-        user = client.account.get()
+        user = await self.lichess.get_account(auth.token)
         embed = discord.Embed(
             title=f"{user['username']}'s Profile",
             description=(
@@ -159,8 +179,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
         variant: str
             Game variant (standard/crazyhouse/chess960/etc), default: standard
         """
-        token, _ = get_auth(ctx.author.id)
-        if token is None:
+        auth = await store.get_auth(ctx.author.id)
+        if auth is None:
             await ctx.send(
                 embed=discord.Embed(
                     title="Not Logged In",
@@ -169,8 +189,6 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 )
             )
             return
-        session = berserk.TokenSession(token)
-        client = berserk.Client(session)
         if clock_limit is not None and clock_increment is not None:
             clock_limit *= 60
             if clock_increment > 180:
@@ -183,7 +201,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 )
                 return
         try:
-            game = client.challenges.create_ai(
+            game = await self.lichess.create_ai_challenge(
+                auth.token,
                 level=level,
                 clock_limit=clock_limit,
                 clock_increment=clock_increment,
@@ -204,8 +223,10 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 color=discord.Color.green(),
             )
             await ctx.send(embed=embed)
-            r.set(f"game_{ctx.author.id}", game["id"])
-        except Exception as e:
+            await store.set_game(game["id"], ctx.author.id)
+        except RateLimited:
+            await send_rate_limited(ctx)
+        except Exception:
             await ctx.send(
                 embed=discord.Embed(
                     title="Error Creating Game",
@@ -243,8 +264,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
         variant: str
             Game variant (standard/crazyhouse/chess960/etc), default: standard
         """
-        token, _ = get_auth(ctx.author.id)
-        if token is None:
+        auth = await store.get_auth(ctx.author.id)
+        if auth is None:
             await ctx.send(
                 embed=discord.Embed(
                     title="Not Logged In",
@@ -253,10 +274,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 )
             )
             return
-        session = berserk.TokenSession(token)
-        client = berserk.Client(session)
-        opponent_token, opponent_username = get_auth(user.id)
-        if opponent_token is None:
+        opponent_auth = await store.get_auth(user.id)
+        if opponent_auth is None:
             await ctx.send(
                 embed=discord.Embed(
                     title="Opponent Not Logged In",
@@ -266,8 +285,9 @@ class Commands(commands.Cog, name="Chessify Commands"):
             )
             return
         try:
-            challenge = client.challenges.create(
-                username=opponent_username,
+            challenge = await self.lichess.create_challenge(
+                auth.token,
+                username=opponent_auth.lichess_username,
                 rated=rated,
                 clock_limit=clock_limit,
                 clock_increment=clock_increment,
@@ -289,10 +309,17 @@ class Commands(commands.Cog, name="Chessify Commands"):
                     color=discord.Color.blue(),
                 )
             )
-            r.set(
-                f"challenge_{challenge['id']}",
-                json.dumps({"message_id": duel_message.id, "user_id": ctx.author.id}),
+            await store.set_challenge(
+                Challenge(
+                    challenge_id=challenge["id"],
+                    message_id=duel_message.id,
+                    user_id=ctx.author.id,
+                    opponent_id=user.id,
+                )
             )
+            self.events.get(user.id, opponent_auth.token)
+        except RateLimited:
+            await send_rate_limited(ctx)
         except Exception as e:
             print(e)
             await ctx.send(
@@ -304,7 +331,13 @@ class Commands(commands.Cog, name="Chessify Commands"):
             )
 
     @commands.hybrid_command(name="stream")
-    async def stream(self, ctx: context, game_id: str):
+    async def stream(
+        self,
+        ctx: context,
+        game_id: str,
+        eval_bar: bool = False,
+        mode: Optional[Literal["image", "text"]] = None,
+    ):
         """
         Stream a game in progress
 
@@ -312,10 +345,14 @@ class Commands(commands.Cog, name="Chessify Commands"):
         -----------
         game_id: str
             The ID of the game to stream
+        eval_bar: bool
+            Show a live engine evaluation under the board, default: False
+        mode: str
+            "image" or "text" board, text boards update faster, default: image
         """
         print(game_id)
-        token, _ = get_auth(ctx.author.id)
-        if token is None:
+        auth = await store.get_auth(ctx.author.id)
+        if auth is None:
             await ctx.send(
                 embed=discord.Embed(
                     title="Not Logged In",
@@ -324,11 +361,34 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 )
             )
             return
-        client = lichess_client.APIClient(token)
+        if eval_bar and not self.engines.available:
+            await ctx.send(
+                embed=discord.Embed(
+                    title="Engine Unavailable",
+                    description="No chess engine is running, stream the game without `eval_bar`.",
+                    color=discord.Color.red(),
+                )
+            )
+            return
         try:
-            r.set(f"game_{ctx.author.id}", game_id)
-            asyncio.create_task(stream_game(ctx, game_id, client))
-        except Exception as e:
+            await store.set_game(game_id, ctx.author.id)
+            await self.supervisor.start_stream(
+                game_id,
+                ctx.author.id,
+                auth.token,
+                ctx,
+                eval_bar=eval_bar,
+                mode=mode or STREAM_BOARD_MODE,
+            )
+        except StreamLimitReached:
+            await ctx.send(
+                embed=discord.Embed(
+                    title="Too Many Streams",
+                    description="Too many games are being streamed. Please try again later.",
+                    color=discord.Color.red(),
+                )
+            )
+        except Exception:
             await ctx.send(
                 embed=discord.Embed(
                     title="Error Streaming Game",
@@ -337,6 +397,33 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 )
             )
 
+    @commands.hybrid_command(name="unstream")
+    async def unstream(self, ctx: context, game_id: str):
+        """
+        Stop streaming a game in this channel
+
+        Parameters:
+        -----------
+        game_id: str
+            The ID of the game to stop streaming
+        """
+        if await self.supervisor.stop_stream(game_id, ctx.channel.id) == 0:
+            await ctx.send(
+                embed=discord.Embed(
+                    title="No Game Stream",
+                    description="This game is not being streamed in this channel.",
+                    color=discord.Color.red(),
+                )
+            )
+            return
+        await ctx.send(
+            embed=discord.Embed(
+                title="Stream Stopped",
+                description=f"Stopped streaming game {game_id}.",
+                color=discord.Color.blue(),
+            )
+        )
+
     @commands.hybrid_command(name="move")
     async def move(self, ctx: context, move: str):
         """
@@ -344,10 +431,10 @@ class Commands(commands.Cog, name="Chessify Commands"):
 
         Parameters:
         -----------
-        move: str in uci notation or "resign" or "draw".
+        move: str in uci or san notation or "resign" or "draw".
         """
-        token, _ = get_auth(ctx.author.id)
-        if token is None:
+        auth = await store.get_auth(ctx.author.id)
+        if auth is None:
             await ctx.send(
                 embed=discord.Embed(
                     title="Not Logged In",
@@ -356,9 +443,7 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 )
             )
             return
-        session = berserk.TokenSession(token)
-        client = berserk.Client(session)
-        game_id = r.get(f"game_{ctx.author.id}")
+        game_id = await store.get_game(ctx.author.id)
         if game_id is None:
             await ctx.send(
                 embed=discord.Embed(
@@ -369,9 +454,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
             )
             return
         try:
-            game_id = game_id.decode("utf-8")
             if move == "resign":
-                client.board.resign_game(game_id)
+                await self.lichess.resign_game(auth.token, game_id)
                 await ctx.send(
                     embed=discord.Embed(
                         title="Resigned",
@@ -380,7 +464,7 @@ class Commands(commands.Cog, name="Chessify Commands"):
                     )
                 )
             elif move == "draw":
-                client.board.offer_draw(game_id)
+                await self.lichess.offer_draw(auth.token, game_id)
                 await ctx.send(
                     embed=discord.Embed(
                         title="Offered Draw",
@@ -389,7 +473,20 @@ class Commands(commands.Cog, name="Chessify Commands"):
                     )
                 )
             else:
-                client.board.make_move(game_id, move)
+                stream = self.supervisor.hub.streams.get(game_id)
+                if stream is not None:
+                    try:
+                        move = stream.check_move(auth.lichess_username, move) or move
+                    except ValueError as e:
+                        await ctx.send(
+                            embed=discord.Embed(
+                                title="Illegal Move",
+                                description=str(e),
+                                color=discord.Color.red(),
+                            )
+                        )
+                        return
+                await self.lichess.make_move(auth.token, game_id, move)
                 await ctx.send(
                     embed=discord.Embed(
                         title="Move Made",
@@ -397,6 +494,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
                         color=discord.Color.green(),
                     )
                 )
+        except RateLimited:
+            await send_rate_limited(ctx)
         except Exception as e:
             print(e)
             await ctx.send(
@@ -412,8 +511,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
         """
         Accept a challenge by replying to the challenge message
         """
-        token, _ = get_auth(ctx.author.id)
-        if token is None:
+        auth = await store.get_auth(ctx.author.id)
+        if auth is None:
             await ctx.send(
                 embed=discord.Embed(
                     title="Not Logged In",
@@ -422,24 +521,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 )
             )
             return
-        session = berserk.TokenSession(token)
-        client = berserk.Client(session)
-        challenges = client.challenges.get_mine()
-        print(challenges)
-        challenge_id = None
-        for challenge in challenges["in"]:
-            data = json.loads(r.get(f"challenge_{challenge['id']}").decode("utf-8"))
-            print(
-                data.get("message_id"),
-                type(data.get("message_id")),
-                ctx.message.reference.message_id,
-                type(ctx.message.reference.message_id),
-            )
-            if data.get("message_id") == ctx.message.reference.message_id:
-                challenge_id = challenge["id"]
-                opponent = challenge["challenger"]["id"]
-                break
-        if challenge_id is None:
+        challenge = await replied_challenge(ctx)
+        if challenge is None:
             await ctx.send(
                 embed=discord.Embed(
                     title="Challenge Not Found",
@@ -448,13 +531,11 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 )
             )
             return
+        events = self.events.get(ctx.author.id, auth.token)
+        started = events.wait("gameStart", challenge.challenge_id)
         try:
-            client = lichess_client.APIClient(token)
-            await client.challenges.accept(challenge_id)
-            opponent_user_id = json.loads(
-                r.get(f"challenge_{challenge_id}").decode("utf-8")
-            ).get("user_id")
-            r.delete(f"challenge_{challenge_id}")
+            await self.lichess.accept_challenge(auth.token, challenge.challenge_id)
+            await store.delete_challenge(challenge.message_id)
             await ctx.send(
                 embed=discord.Embed(
                     title="Challenge Accepted",
@@ -462,9 +543,22 @@ class Commands(commands.Cog, name="Chessify Commands"):
                     color=discord.Color.green(),
                 )
             )
-            asyncio.create_task(stream_events(ctx, client, opponent, opponent_user_id))
+            self.supervisor.spawn(
+                stream_duel(
+                    ctx,
+                    events,
+                    started,
+                    auth.token,
+                    challenge.user_id,
+                    self.supervisor,
+                )
+            )
+        except RateLimited:
+            events.discard(started)
+            await send_rate_limited(ctx)
         except Exception as e:
             print(e)
+            events.discard(started)
             await ctx.send(
                 embed=discord.Embed(
                     title="Error Accepting Challenge",
@@ -482,8 +576,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
         -----------
         reason: str (optional) - Reason for declining the challenge (generic, later, tooFast, tooSlow, timeControl, rated, casual, standard, variant, noBot, onlyBot) - default: generic
         """
-        token, _ = get_auth(ctx.author.id)
-        if token is None:
+        auth = await store.get_auth(ctx.author.id)
+        if auth is None:
             await ctx.send(
                 embed=discord.Embed(
                     title="Not Logged In",
@@ -492,16 +586,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 )
             )
             return
-        session = berserk.TokenSession(token)
-        client = berserk.Client(session)
-        challenges = client.challenges.get_mine()
-        challenge_id = None
-        for challenge in challenges["in"]:
-            data = json.loads(r.get(f"challenge_{challenge['id']}").decode("utf-8"))
-            if data.get("message_id") == ctx.message.reference.message_id:
-                challenge_id = challenge["id"]
-                break
-        if challenge_id is None:
+        challenge = await replied_challenge(ctx)
+        if challenge is None:
             await ctx.send(
                 embed=discord.Embed(
                     title="Challenge Not Found",
@@ -511,8 +597,10 @@ class Commands(commands.Cog, name="Chessify Commands"):
             )
             return
         try:
-            client.challenges.decline(challenge_id, reason)
-            r.delete(f"challenge_{challenge_id}")
+            await self.lichess.decline_challenge(
+                auth.token, challenge.challenge_id, reason
+            )
+            await store.delete_challenge(challenge.message_id)
             await ctx.send(
                 embed=discord.Embed(
                     title="Challenge Declined",
@@ -520,7 +608,9 @@ class Commands(commands.Cog, name="Chessify Commands"):
                     color=discord.Color.red(),
                 )
             )
-        except Exception as e:
+        except RateLimited:
+            await send_rate_limited(ctx)
+        except Exception:
             await ctx.send(
                 embed=discord.Embed(
                     title="Error Declining Challenge",
@@ -539,8 +629,8 @@ class Commands(commands.Cog, name="Chessify Commands"):
         game_id: str
             The Lichess game ID to animate
         """
-        token, _ = get_auth(ctx.author.id)
-        if token is None:
+        auth = await store.get_auth(ctx.author.id)
+        if auth is None:
             await ctx.send(
                 embed=discord.Embed(
                     title="Not Logged In",
@@ -549,30 +639,262 @@ class Commands(commands.Cog, name="Chessify Commands"):
                 )
             )
             return
-        session = berserk.TokenSession(token)
-        client = berserk.Client(session)
         try:
-            game = client.games.export(game_id)
-            moves = game["moves"]
-            white = (
-                f"AI lvl {game['players']['white']['aiLevel']}"
-                if game["players"]["white"].get("aiLevel")
-                else game["players"]["white"]["user"]["name"]
-            )
-            black = (
-                f"AI lvl {game['players']['black']['aiLevel']}"
-                if game["players"]["black"].get("aiLevel")
-                else game["players"]["black"]["user"]["name"]
-            )
-            embed, image = create_board_gif(moves)
-            embed.set_footer(text=f"{white} vs {black}")
-            await ctx.send(embed=embed, file=image)
+            game = await self.replay_cache.get_game(game_id)
+            gif = await self.replay_cache.get_replay(game_id) if game else None
+            if gif is not None:
+                embed, image = replay_message(gif)
+                embed.set_footer(text=replay_players(game))
+                await ctx.send(embed=embed, file=image)
+                return
+            message = await ctx.send(
+                embed=discord.Embed(
+                    title="Replay Queued",
+                    description=f"The replay of game {game_id} will appear here once it is rendered.",
+                    color=discord.Color.blue(),
+                )
+            )
+            await self.jobs.enqueue(
+                Job(
+                    job_id=f"replay:{game_id}",
+                    kind="replay",
+                    payload={"game_id": game_id, "user_id": ctx.author.id},
+                ),
+                JobWaiter(channel_id=message.channel.id, message_id=message.id),
+            )
         except Exception as e:
+            print(e)
             await ctx.send(
                 embed=discord.Embed(
-                    title="Error Fetching Game",
-                    description="Invalid game ID provided.",
+                    title="Error Queueing Replay",
+                    description="The replay could not be queued. Please try again later.",
+                    color=discord.Color.red(),
+                )
+            )
+
+    @commands.hybrid_command(name="analyze")
+    async def analyze(self, ctx: context, game_id: str):
+        """
+        Analyze every move of a game with a chess engine
+
+        Parameters:
+        -----------
+        game_id: str
+            The Lichess game ID to analyze
+        """
+        auth = await store.get_auth(ctx.author.id)
+        if auth is None:
+            await ctx.send(
+                embed=discord.Embed(
+                    title="Not Logged In",
+                    description="Please use `/login` to connect your Lichess account first.",
+                    color=discord.Color.red(),
+                )
+            )
+            return
+        try:
+            message = await ctx.send(
+                embed=discord.Embed(
+                    title="Analysis Queued",
+                    description=f"The analysis of game {game_id} will appear here once it is done.",
+                    color=discord.Color.blue(),
+                )
+            )
+            await self.jobs.enqueue(
+                Job(
+                    job_id=f"analysis:{game_id}",
+                    kind="analysis",
+                    payload={"game_id": game_id, "user_id": ctx.author.id},
+                ),
+                JobWaiter(channel_id=message.channel.id, message_id=message.id),
+            )
+        except Exception as e:
+            print(e)
+            await ctx.send(
+                embed=discord.Embed(
+                    title="Error Queueing Analysis",
+                    description="The analysis could not be queued. Please try again later.",
+                    color=discord.Color.red(),
+                )
+            )
+
+    @commands.hybrid_command(name="import_history")
+    async def import_history(self, ctx: context):
+        """Import your Lichess game history for `/stats`"""
+        auth = await store.get_auth(ctx.author.id)
+        if auth is None:
+            await ctx.send(
+                embed=discord.Embed(
+                    title="Not Logged In",
+                    description="Please use `/login` to connect your Lichess account first.",
+                    color=discord.Color.red(),
+                )
+            )
+            return
+        username = auth.lichess_username.lower()
+        try:
+            message = await ctx.send(
+                embed=discord.Embed(
+                    title="Import Queued",
+                    description=f"The games of {auth.lichess_username} will be imported shortly.",
+                    color=discord.Color.blue(),
+                )
+            )
+            await self.jobs.enqueue(
+                Job(
+                    job_id=f"history:{username}",
+                    kind="history",
+                    payload={"username": username, "user_id": ctx.author.id},
+                ),
+                JobWaiter(channel_id=message.channel.id, message_id=message.id),
+            )
+        except Exception as e:
+            print(e)
+            await ctx.send(
+                embed=discord.Embed(
+                    title="Error Queueing Import",
+                    description="The import could not be queued. Please try again later.",
+                    color=discord.Color.red(),
+                )
+            )
+
+    @commands.hybrid_command(name="stats")
+    async def stats(
+        self,
+        ctx: context,
+        opening: Optional[str] = None,
+        username: Optional[str] = None,
+    ):
+        """
+        View win/loss statistics of imported games
+
+        Parameters:
+        -----------
+        opening: str
+            Only count openings whose name contains this text
+        username: str
+            Lichess username, default: your own
+        """
+        if username is None:
+            auth = await store.get_auth(ctx.author.id)
+            if auth is None:
+                await ctx.send(
+                    embed=discord.Embed(
+                        title="Not Logged In",
+                        description="Please use `/login` to connect your Lichess account first.",
+                        color=discord.Color.red(),
+                    )
+                )
+                return
+            username = auth.lichess_username
+        stats = await asyncio.to_thread(self.history.stats, username, opening)
+        results = stats["results"]
+        total = sum(results.values())
+        if total == 0:
+            await ctx.send(
+                embed=discord.Embed(
+                    title="No Games",
+                    description=f"No imported games found for {username}. Use `/import_history` first.",
                     color=discord.Color.red(),
                 )
             )
             return
+        openings = "\n".join(
+            f"{name}: {games} games, {wins / games:.0%} won"
+            for name, games, wins in stats["openings"]
+        )
+        await ctx.send(
+            embed=discord.Embed(
+                title=f"{username}'s Stats" + (f" ({opening})" if opening else ""),
+                description=(
+                    f"**Games:** {total}\n"
+                    f"**Wins:** {results.get('win', 0)}\n"
+                    f"**Losses:** {results.get('loss', 0)}\n"
+                    f"**Draws:** {results.get('draw', 0)}\n"
+                    f"**Win Rate:** {results.get('win', 0) / total:.0%}\n\n"
+                    f"**Most Played Openings:**\n{openings or 'None'}"
+                ),
+                color=discord.Color.blue(),
+            )
+        )
+
+    @commands.hybrid_command(name="position")
+    async def position(self, ctx: context, fen: Optional[str] = None):
+        """
+        Find indexed games that reached a position
+
+        Parameters:
+        -----------
+        fen: str
+            Position to search, default: the board of your streamed game
+        """
+        if fen is None:
+            game_id = await store.get_game(ctx.author.id)
+            stream = self.supervisor.hub.streams.get(game_id) if game_id else None
+            if stream is None:
+                await ctx.send(
+                    embed=discord.Embed(
+                        title="No Position",
+                        description="Please provide a FEN or stream a game in progress.",
+                        color=discord.Color.red(),
+                    )
+                )
+                return
+            board = stream.live_board.board.copy(stack=False)
+        else:
+            try:
+                board = chess.Board(fen)
+            except ValueError:
+                await ctx.send(
+                    embed=discord.Embed(
+                        title="Invalid FEN",
+                        description="The provided FEN is not a valid position.",
+                        color=discord.Color.red(),
+                    )
+                )
+                return
+        found = await asyncio.to_thread(self.positions.lookup, board)
+        if found["total"] == 0:
+            await ctx.send(
+                embed=discord.Embed(
+                    title="No Games",
+                    description="No indexed game reached this position.",
+                    color=discord.Color.red(),
+                )
+            )
+            return
+        moves = "\n".join(
+            f"**{san}:** {games} games, +{white} ={draws} -{black}"
+            for san, games, white, draws, black in found["moves"][:8]
+        )
+        games = "\n".join(
+            f"https://lichess.org/{game_id}" for game_id in found["games"]
+        )
+        await ctx.send(
+            embed=discord.Embed(
+                title="Position Search",
+                description=(
+                    f"**Games:** {found['total']}\n\n"
+                    f"**Moves Played:**\n{moves or 'None'}\n\n"
+                    f"**Games:**\n{games}"
+                ),
+                color=discord.Color.blue(),
+            ).set_footer(text=board.fen())
+        )
+
+    @commands.hybrid_command(name="render_stats")
+    async def render_stats(self, ctx: context):
+        """View hit and miss counters of the render cache"""
+        cache = self.render_service.cache
+        await ctx.send(
+            embed=discord.Embed(
+                title="Render Cache",
+                description=(
+                    f"**Memory Hits:** {cache.stats['memory_hits']}\n"
+                    f"**Redis Hits:** {cache.stats['redis_hits']}\n"
+                    f"**Misses:** {cache.stats['misses']}\n"
+                    f"**Memory Used:** {cache.memory.size / 1024 / 1024:.1f} MB"
+                ),
+                color=discord.Color.blue(),
+            )
+        )
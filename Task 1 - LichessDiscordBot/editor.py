@@ -0,0 +1,123 @@
+import asyncio
+import os
+import time
+from typing import Callable, Hashable, Optional
+
+import discord
+
+from board import board_message
+
+EDIT_RATE = int(os.getenv("EDIT_RATE", 5))
+EDIT_PERIOD = float(os.getenv("EDIT_PERIOD", 5))
+
+
+class ChannelBucket:
+    """Token bucket matching Discord's message edit rate limit for a channel."""
+
+    def __init__(self, rate: int = EDIT_RATE, period: float = EDIT_PERIOD):
+        self.rate = rate
+        self.period = period
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(
+                    self.rate,
+                    self.tokens + (now - self.updated) * self.rate / self.period,
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.period / self.rate)
+
+    def block(self, retry_after: float) -> None:
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+class MessageEditor:
+    """
+    Edits one stream message, coalescing pending updates to the latest one.
+
+    Updates are identified by a key (the position and status shown); an
+    update with the key already on screen is dropped. An update with the
+    board image already on screen only edits the embed, without uploading
+    the image again.
+    """
+
+    def __init__(
+        self,
+        message: discord.Message,
+        bucket: ChannelBucket,
+        on_gone: Callable[[discord.Message], None],
+        eval_bar: bool = False,
+        mode: str = "image",
+    ):
+        self.message = message
+        self.bucket = bucket
+        self.on_gone = on_gone
+        self.eval_bar = eval_bar
+        self.mode = mode
+        self.shown = None
+        self.shown_png = None
+        self.pending = None
+        self.task = None
+
+    def submit(
+        self,
+        key: Hashable,
+        embed: Optional[discord.Embed] = None,
+        png: Optional[bytes] = None,
+    ) -> None:
+        if key == self.shown and self.pending is None:
+            return
+        self.pending = (key, embed, png)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.drain())
+
+    async def drain(self) -> None:
+        while self.pending is not None:
+            await self.bucket.acquire()
+            if self.pending is None:
+                return
+            key, embed, png = self.pending
+            self.pending = None
+            if key == self.shown:
+                continue
+            try:
+                if png is None:
+                    await self.message.edit(embed=embed)
+                elif png is self.shown_png:
+                    embed, _ = board_message(png, embed)
+                    await self.message.edit(embed=embed)
+                else:
+                    embed, image = board_message(png, embed)
+                    await self.message.edit(embed=embed, attachments=[image])
+                self.shown, self.shown_png = key, png
+            except (discord.NotFound, discord.Forbidden):
+                self.on_gone(self.message)
+                return
+            except discord.HTTPException as e:
+                if e.status != 429:
+                    raise
+                retry_after = getattr(e, "retry_after", None) or self.bucket.period
+                self.bucket.block(retry_after)
+                if self.pending is None:
+                    self.pending = (key, embed, png)
+
+    async def flush(self) -> None:
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+
+    def cancel(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
@@ -0,0 +1,446 @@
+import asyncio
+import math
+import os
+import shlex
+from collections import OrderedDict
+from typing import Optional, Union
+
+import chess
+import chess.engine
+import redis.asyncio as aioredis
+
+import store
+from models.data import Evaluation
+
+ENGINE_PATH = os.getenv("ENGINE_PATH", "stockfish")
+ENGINE_WORKERS = int(os.getenv("ENGINE_WORKERS", 2))
+ENGINE_DEPTH = int(os.getenv("ENGINE_DEPTH", 14))
+ENGINE_STREAM_DEPTH = int(os.getenv("ENGINE_STREAM_DEPTH", 10))
+ENGINE_TIMEOUT = float(os.getenv("ENGINE_TIMEOUT", 30))
+ENGINE_RETRY = float(os.getenv("ENGINE_RETRY", 30))
+ENGINE_CACHE_SIZE = int(os.getenv("ENGINE_CACHE_SIZE", 100000))
+ENGINE_CACHE_TTL = int(os.getenv("ENGINE_CACHE_TTL", 30 * 24 * 3600))
+
+ANALYZED_VARIANTS = {"standard", "chess960", "fromPosition"}
+MATE_SCORE = 100000
+# Evaluations are clamped to this many centipawns when measuring the loss of
+# a move, so missing a mate in a won position does not dominate the average.
+LOSS_CLAMP = 1000
+INACCURACY, MISTAKE, BLUNDER = 50, 100, 300
+# Default of EnginePool.evaluate for "the cache was not checked yet", None
+# means it was checked and missed.
+NOT_LOOKED_UP = object()
+
+SET_EVAL = """
+local depth = tonumber(redis.call("HGET", KEYS[1], "depth") or "-1")
+if depth < tonumber(ARGV[1]) then
+    redis.call("HSET", KEYS[1], "depth", ARGV[1], "score", ARGV[2], "best", ARGV[3])
+end
+redis.call("EXPIRE", KEYS[1], ARGV[4])
+"""
+
+
+class EngineUnavailable(Exception):
+    pass
+
+
+def position_key(board: chess.Board) -> str:
+    """
+    Cache key of a position: the FEN without the move counters, so
+    transpositions reached at different moves share their evaluation.
+    """
+    return board.epd()
+
+
+def format_score(score: int) -> str:
+    if abs(score) > MATE_SCORE - 1000:
+        moves = MATE_SCORE - abs(score)
+        if moves == 0:
+            return "1-0" if score > 0 else "0-1"
+        return f"#{'-' if score < 0 else ''}{moves}"
+    return f"{score / 100:+.2f}"
+
+
+def eval_bar(evaluation: Evaluation, width: int = 10) -> str:
+    """
+    Text bar of the winning chances of white for a stream embed.
+
+    Args:
+    - evaluation: evaluation of the position.
+    - width: number of cells in the bar.
+
+    Returns:
+    - e.g. "██████░░░░ +0.45 (depth 10)".
+    """
+    score = max(-LOSS_CLAMP, min(LOSS_CLAMP, evaluation.score))
+    white = round(width / (1 + math.pow(10, -score / 400)))
+    return (
+        f"`{'█' * white}{'░' * (width - white)}` "
+        f"{format_score(evaluation.score)} (depth {evaluation.depth})"
+    )
+
+
+def game_boards(game: dict) -> tuple[list[chess.Board], list[str]]:
+    """
+    Every position of an exported game.
+
+    Args:
+    - game: game as returned by the Lichess export, with san moves.
+
+    Returns:
+    - the positions from the start to the final one, and the san moves
+      between them.
+
+    Raises:
+    - ValueError if the variant cannot be analyzed.
+    """
+    variant = game.get("variant", "standard")
+    if variant not in ANALYZED_VARIANTS:
+        raise ValueError(f"Variant {variant} cannot be analyzed.")
+    board = chess.Board(
+        game.get("initialFen", chess.STARTING_FEN), chess960=variant == "chess960"
+    )
+    boards, moves = [board.copy(stack=False)], game.get("moves", "").split()
+    for move in moves:
+        board.push_san(move)
+        boards.append(board.copy(stack=False))
+    return boards, moves
+
+
+def summarize(
+    boards: list[chess.Board], moves: list[str], evaluations: list[Evaluation]
+) -> dict:
+    """
+    Measure the quality of the moves of a game from its evaluations.
+
+    Args:
+    - boards: every position of the game, see game_boards.
+    - moves: san moves between the positions.
+    - evaluations: evaluation of every position.
+
+    Returns:
+    - {"white"/"black": {"acpl": average centipawn loss, "inaccuracies",
+      "mistakes", "blunders"}, "worst": [(loss, label, before, after, best)]}
+      with the three worst moves first.
+    """
+    stats = {
+        color: {"loss": 0, "moves": 0, "inaccuracies": 0, "mistakes": 0, "blunders": 0}
+        for color in ("white", "black")
+    }
+    worst = []
+    for ply, san in enumerate(moves):
+        board = boards[ply]
+        before, after = evaluations[ply].score, evaluations[ply + 1].score
+        sign = 1 if board.turn == chess.WHITE else -1
+        loss = max(
+            0,
+            sign
+            * (
+                max(-LOSS_CLAMP, min(LOSS_CLAMP, before))
+                - max(-LOSS_CLAMP, min(LOSS_CLAMP, after))
+            ),
+        )
+        color = stats["white" if board.turn == chess.WHITE else "black"]
+        color["loss"] += loss
+        color["moves"] += 1
+        if loss >= BLUNDER:
+            color["blunders"] += 1
+        elif loss >= MISTAKE:
+            color["mistakes"] += 1
+        elif loss >= INACCURACY:
+            color["inaccuracies"] += 1
+        if loss >= MISTAKE:
+            number = f"{board.fullmove_number}{'.' if board.turn else '...'}"
+            best = evaluations[ply].best
+            best = board.san(chess.Move.from_uci(best)) if best else None
+            worst.append((loss, f"{number} {san}", before, after, best))
+    for color in stats.values():
+        color["acpl"] = round(color.pop("loss") / max(color.pop("moves"), 1))
+    worst.sort(key=lambda move: -move[0])
+    return {**stats, "worst": worst[:3]}
+
+
+class EvalCache:
+    """
+    Two tier cache of evaluations keyed by position: an in-process LRU of
+    max_entries positions and Redis, shared by every process running
+    engines.
+
+    Only the deepest evaluation of a position is kept, and it answers every
+    request for the same or a lower depth.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ENGINE_CACHE_SIZE,
+        redis_ttl: int = ENGINE_CACHE_TTL,
+        redis: Optional[aioredis.Redis] = None,
+    ):
+        self.max_entries = max_entries
+        self.redis_ttl = redis_ttl
+        self.redis = redis or store.r
+        self.set_script = self.redis.register_script(SET_EVAL)
+        self.memory = OrderedDict()
+        self.stats = {"memory_hits": 0, "redis_hits": 0, "misses": 0}
+
+    def remember(self, key: str, evaluation: Evaluation) -> None:
+        known = self.memory.get(key)
+        if known is not None and known.depth > evaluation.depth:
+            return
+        self.memory[key] = evaluation
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    async def get_many(self, keys: list[str], depth: int) -> list[Optional[Evaluation]]:
+        """
+        Look up the evaluations of several positions with one Redis round
+        trip for the positions missing from memory.
+
+        Args:
+        - keys: position keys, see position_key.
+        - depth: minimum depth of a usable evaluation.
+
+        Returns:
+        - the evaluation of every position, None for misses.
+        """
+        found = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            evaluation = self.memory.get(key)
+            if evaluation is not None and evaluation.depth >= depth:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                found[i] = evaluation
+            else:
+                missing.append(i)
+        if missing:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for i in missing:
+                        pipe.hmget(f"eval:{keys[i]}", "depth", "score", "best")
+                    rows = await pipe.execute()
+            except aioredis.RedisError as e:
+                print(e)
+                rows = [(None, None, None)] * len(missing)
+            for i, (stored, score, best) in zip(missing, rows):
+                if stored is None or int(stored) < depth:
+                    self.stats["misses"] += 1
+                    continue
+                found[i] = Evaluation(
+                    depth=int(stored),
+                    score=int(score),
+                    best=best.decode("utf-8") or None,
+                )
+                self.stats["redis_hits"] += 1
+                self.remember(keys[i], found[i])
+        return found
+
+    async def set(self, key: str, evaluation: Evaluation) -> None:
+        self.remember(key, evaluation)
+        try:
+            await self.set_script(
+                keys=[f"eval:{key}"],
+                args=[
+                    evaluation.depth,
+                    evaluation.score,
+                    evaluation.best or "",
+                    self.redis_ttl,
+                ],
+            )
+        except aioredis.RedisError as e:
+            print(e)
+
+
+class EnginePool:
+    """
+    Pool of local UCI engine processes driven through chess.engine.
+
+    Every engine analyzes one position at a time, callers wait for an idle
+    engine, so at most workers positions are searched at once. Evaluations
+    go through an EvalCache first and concurrent requests for the same
+    position and depth share one search, which is cancelled once nobody
+    waits for it anymore. An engine that crashes or times out is restarted,
+    every ENGINE_RETRY seconds until it runs again. Callers waiting while no
+    engine runs fail with EngineUnavailable.
+    """
+
+    def __init__(
+        self,
+        path: str = ENGINE_PATH,
+        workers: int = ENGINE_WORKERS,
+        timeout: float = ENGINE_TIMEOUT,
+        retry: float = ENGINE_RETRY,
+        cache: Optional[EvalCache] = None,
+    ):
+        self.command = shlex.split(path)
+        self.workers = workers
+        self.timeout = timeout
+        self.retry = retry
+        self.cache = cache or EvalCache()
+        self.engines = []
+        self.idle = []
+        self.changed = None
+        self.restarting = None
+        self.inflight = {}
+
+    @property
+    def available(self) -> bool:
+        return bool(self.engines)
+
+    async def launch(self) -> chess.engine.UciProtocol:
+        _, engine = await chess.engine.popen_uci(self.command)
+        self.engines.append(engine)
+        return engine
+
+    async def start(self) -> None:
+        """Start the engines, the pool stays unavailable if they cannot run."""
+        self.changed = asyncio.Condition()
+        try:
+            for _ in range(self.workers):
+                self.idle.append(await self.launch())
+        except (OSError, chess.engine.EngineError) as e:
+            print(f"Could not start engine {self.command}: {e!r}")
+            await self.close()
+
+    async def acquire(self) -> chess.engine.UciProtocol:
+        if not self.available:
+            raise EngineUnavailable()
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.idle or not self.available)
+            if not self.idle:
+                raise EngineUnavailable()
+            return self.idle.pop()
+
+    async def release(self, engine: Optional[chess.engine.UciProtocol]) -> None:
+        async with self.changed:
+            if engine is not None:
+                self.idle.append(engine)
+            self.changed.notify_all()
+
+    async def replace(self, engine: chess.engine.UciProtocol) -> None:
+        """Quit a failed engine and start another one in its place."""
+        self.engines.remove(engine)
+        asyncio.ensure_future(engine.quit())
+        try:
+            await self.release(await self.launch())
+        except (OSError, chess.engine.EngineError) as e:
+            print(f"Could not restart engine {self.command}: {e!r}")
+            await self.release(None)
+            if self.restarting is None or self.restarting.done():
+                self.restarting = asyncio.ensure_future(self.restart())
+
+    async def restart(self) -> None:
+        while len(self.engines) < self.workers:
+            await asyncio.sleep(self.retry)
+            try:
+                await self.release(await self.launch())
+            except (OSError, chess.engine.EngineError) as e:
+                print(f"Could not restart engine {self.command}: {e!r}")
+
+    async def search(self, board: chess.Board, key: str, depth: int) -> Evaluation:
+        engine = await self.acquire()
+        try:
+            info = await asyncio.wait_for(
+                engine.analyse(board, chess.engine.Limit(depth=depth)), self.timeout
+            )
+        except (asyncio.TimeoutError, chess.engine.EngineError) as e:
+            print(f"Engine failed on {board.fen()}: {e!r}")
+            await self.replace(engine)
+            raise EngineUnavailable() from e
+        except BaseException:
+            await self.release(engine)
+            raise
+        await self.release(engine)
+        pv = info.get("pv")
+        evaluation = Evaluation(
+            depth=info.get("depth", depth),
+            score=info["score"].white().score(mate_score=MATE_SCORE),
+            best=pv[0].uci() if pv else None,
+        )
+        await self.cache.set(key, evaluation)
+        return evaluation
+
+    async def evaluate(
+        self,
+        board: chess.Board,
+        depth: int = ENGINE_DEPTH,
+        cached: Union[Evaluation, None, object] = NOT_LOOKED_UP,
+    ) -> Evaluation:
+        """
+        Evaluate a position to at least depth plies.
+
+        Args:
+        - board: the position.
+        - depth: minimum search depth.
+        - cached: result of a cache lookup already made by the caller, None
+          for a miss.
+
+        Returns:
+        - the evaluation, from the point of view of white.
+
+        Raises:
+        - EngineUnavailable if no engine could search the position.
+        """
+        if board.is_game_over():
+            outcome = board.outcome()
+            if outcome.winner is None:
+                return Evaluation(depth=depth, score=0)
+            return Evaluation(
+                depth=depth, score=MATE_SCORE if outcome.winner else -MATE_SCORE
+            )
+        key = position_key(board)
+        if cached is NOT_LOOKED_UP:
+            (cached,) = await self.cache.get_many([key], depth)
+        if cached is not None:
+            return cached
+        search = self.inflight.get((key, depth))
+        if search is None:
+            task = asyncio.ensure_future(self.search(board, key, depth))
+            search = self.inflight[(key, depth)] = [task, 0]
+            task.add_done_callback(lambda _: self.inflight.pop((key, depth), None))
+        task = search[0]
+        search[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            search[1] -= 1
+            if search[1] == 0 and not task.done():
+                task.cancel()
+
+    async def analyze(
+        self, boards: list[chess.Board], depth: int = ENGINE_DEPTH
+    ) -> list[Evaluation]:
+        """
+        Evaluate every position of a game, spread over all engines.
+
+        Args:
+        - boards: the positions, see game_boards.
+        - depth: minimum search depth.
+
+        Returns:
+        - the evaluation of every position.
+        """
+        cached = await self.cache.get_many(
+            [position_key(board) for board in boards], depth
+        )
+        return list(
+            await asyncio.gather(
+                *[
+                    self.evaluate(board, depth, evaluation)
+                    for board, evaluation in zip(boards, cached)
+                ]
+            )
+        )
+
+    async def close(self) -> None:
+        if self.restarting is not None:
+            self.restarting.cancel()
+        engines, self.engines, self.idle = self.engines, [], []
+        if self.changed is not None:
+            await self.release(None)
+        for engine in engines:
+            try:
+                await asyncio.wait_for(engine.quit(), 5)
+            except (asyncio.TimeoutError, chess.engine.EngineError):
+                pass
@@ -0,0 +1,184 @@
+import asyncio
+import os
+from typing import Hashable, Optional
+
+import aiohttp
+
+from hub import STREAM_RETRY_MAX, STREAM_RETRY_MIN
+from lichess import LichessClient, LichessError
+
+EVENT_WAIT_TIMEOUT = float(os.getenv("EVENT_WAIT_TIMEOUT", 60))
+EVENT_IDLE_TIMEOUT = float(os.getenv("EVENT_IDLE_TIMEOUT", 600))
+
+
+def event_keys(event: dict) -> list:
+    """
+    Keys under which waiters can subscribe to an incoming event.
+
+    Args:
+    - event: decoded event of the Lichess incoming events stream.
+
+    Returns:
+    - (type, game id) and (type, opponent id) for game events,
+      (type, challenge id) for challenge events.
+    """
+    if "game" in event:
+        game = event["game"]
+        keys = [(event["type"], game.get("gameId") or game.get("id"))]
+        opponent = game.get("opponent") or {}
+        if opponent.get("id"):
+            keys.append((event["type"], opponent["id"]))
+        return keys
+    if "challenge" in event:
+        return [(event["type"], event["challenge"]["id"])]
+    return []
+
+
+class EventDispatcher:
+    """
+    Long-lived incoming events stream of one Lichess user.
+
+    gameStart, gameFinish and challenge events are routed to the futures
+    waiting for their game, opponent or challenge id. A dropped connection
+    is reopened with exponential backoff, and Lichess replays the gameStart
+    of ongoing games on reconnect. The stream is closed once nothing waited
+    on it for idle_timeout seconds.
+    """
+
+    def __init__(
+        self,
+        lichess: LichessClient,
+        token: str,
+        idle_timeout: float = EVENT_IDLE_TIMEOUT,
+    ):
+        self.lichess = lichess
+        self.token = token
+        self.idle_timeout = idle_timeout
+        self.waiters = {}
+        self.task = None
+        self.idle_timer = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+        self.watch_idle()
+
+    def watch_idle(self) -> None:
+        if self.waiters or self.idle_timer is not None:
+            return
+        self.idle_timer = asyncio.get_running_loop().call_later(
+            self.idle_timeout, self.close
+        )
+
+    async def run(self) -> None:
+        delay = STREAM_RETRY_MIN
+        while True:
+            try:
+                async for event in self.lichess.stream_incoming_events(self.token):
+                    delay = STREAM_RETRY_MIN
+                    self.dispatch(event)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Event stream dropped: {e}")
+            except LichessError as e:
+                print(e)
+                if e.status == 401:
+                    return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STREAM_RETRY_MAX)
+
+    def dispatch(self, event: dict) -> None:
+        for key in event_keys(event):
+            for future in self.waiters.pop(key, []):
+                if not future.done():
+                    future.set_result(event)
+        self.watch_idle()
+
+    def wait(self, event_type: str, key: Hashable) -> asyncio.Future:
+        """
+        Register interest in the next event of a type for a game, opponent or
+        challenge id. Register before triggering the event to not miss it.
+
+        Args:
+        - event_type: Lichess event type, e.g. "gameStart".
+        - key: game id, opponent Lichess id or challenge id.
+
+        Returns:
+        - future resolved with the event.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault((event_type, key), []).append(future)
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+        return future
+
+    async def wait_for(
+        self, future: asyncio.Future, timeout: float = EVENT_WAIT_TIMEOUT
+    ) -> Optional[dict]:
+        """Await a future from wait, returning None if nothing arrived in time."""
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.discard(future)
+            return None
+        except asyncio.CancelledError:
+            self.discard(future)
+            raise
+
+    def discard(self, future: asyncio.Future) -> None:
+        for key, futures in list(self.waiters.items()):
+            if future in futures:
+                futures.remove(future)
+                if not futures:
+                    del self.waiters[key]
+        future.cancel()
+        self.watch_idle()
+
+    def close(self) -> None:
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+        if self.task is not None:
+            self.task.cancel()
+        for futures in self.waiters.values():
+            for future in futures:
+                future.cancel()
+        self.waiters.clear()
+
+
+class EventRouter:
+    """
+    Keeps one EventDispatcher per Discord user, restarted on a new token and
+    forgotten once its stream stopped.
+    """
+
+    def __init__(
+        self, lichess: LichessClient, idle_timeout: float = EVENT_IDLE_TIMEOUT
+    ):
+        self.lichess = lichess
+        self.idle_timeout = idle_timeout
+        self.dispatchers = {}
+
+    def get(self, user_id: int, token: str) -> EventDispatcher:
+        dispatcher = self.dispatchers.get(user_id)
+        if dispatcher is not None and (
+            dispatcher.token != token or dispatcher.task.done()
+        ):
+            dispatcher.close()
+            dispatcher = None
+        if dispatcher is None:
+            dispatcher = EventDispatcher(self.lichess, token, self.idle_timeout)
+            self.dispatchers[user_id] = dispatcher
+            dispatcher.start()
+            dispatcher.task.add_done_callback(
+                lambda _: self.forget(user_id, dispatcher)
+            )
+        return dispatcher
+
+    def forget(self, user_id: int, dispatcher: EventDispatcher) -> None:
+        if self.dispatchers.get(user_id) is dispatcher:
+            del self.dispatchers[user_id]
+
+    def close(self) -> None:
+        for dispatcher in self.dispatchers.values():
+            dispatcher.close()
+        self.dispatchers.clear()
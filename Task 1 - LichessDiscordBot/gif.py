@@ -0,0 +1,75 @@
+from typing import BinaryIO, Optional
+
+from PIL import GifImagePlugin, Image, ImageChops
+
+
+class GifEncoder:
+    """
+    Animated GIF writer with one global palette and delta frames.
+
+    Every frame after the first only stores the rectangle that changed and
+    is drawn over the previous one (disposal 1). Frames identical to the
+    previous one extend its duration instead of being written.
+    """
+
+    def __init__(
+        self, fp: BinaryIO, palette: Image.Image, duration: int = 500, loop: int = 0
+    ):
+        self.fp = fp
+        self.palette = palette
+        self.duration = duration
+        self.loop = loop
+        self.previous = None
+        self.pending = None
+
+    def add_frame(
+        self,
+        frame: Image.Image,
+        box: Optional[tuple[int, int, int, int]] = None,
+        duration: Optional[int] = None,
+    ) -> None:
+        """
+        Add a frame to the animation.
+
+        Args:
+        - frame: full frame in "P" mode using the shared palette.
+        - box: region that changed since the previous frame, computed from the
+          pixels when not given.
+        - duration: display time in milliseconds, defaults to the encoder's.
+        """
+        duration = duration or self.duration
+        if self.previous is None:
+            self.write_header(frame)
+            box = (0, 0) + frame.size
+        elif box is None:
+            box = ImageChops.difference(self.previous, frame).getbbox()
+        if box is None:
+            self.pending[2] += duration
+            self.previous = frame
+            return
+        self.flush()
+        self.pending = [frame.crop(box), box[:2], duration]
+        self.previous = frame
+
+    def write_header(self, frame: Image.Image) -> None:
+        header, _ = GifImagePlugin.getheader(
+            frame,
+            info={"loop": self.loop, "duration": self.duration, "optimize": False},
+        )
+        for block in header:
+            self.fp.write(block)
+
+    def flush(self) -> None:
+        if self.pending is None:
+            return
+        region, offset, duration = self.pending
+        region.putpalette(self.palette.getpalette())
+        for block in GifImagePlugin.getdata(
+            region, offset=offset, duration=duration, disposal=1
+        ):
+            self.fp.write(block)
+        self.pending = None
+
+    def close(self) -> None:
+        self.flush()
+        self.fp.write(b";")
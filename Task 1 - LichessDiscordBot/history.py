@@ -0,0 +1,195 @@
+import asyncio
+import contextlib
+import os
+import sqlite3
+from typing import Iterator, Optional
+
+from lichess import LichessClient
+
+HISTORY_DB = os.getenv(
+    "HISTORY_DB", os.path.join(os.path.dirname(__file__), ".history.db")
+)
+HISTORY_BATCH = int(os.getenv("HISTORY_BATCH", 500))
+
+NOT_PLAYED = {"created", "started", "aborted", "noStart"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    played_at INTEGER NOT NULL,
+    color TEXT NOT NULL,
+    opponent TEXT NOT NULL,
+    result TEXT NOT NULL,
+    opening_eco TEXT,
+    opening_name TEXT,
+    speed TEXT,
+    rated INTEGER NOT NULL,
+    PRIMARY KEY (username, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS games_date ON games (username, played_at);
+CREATE INDEX IF NOT EXISTS games_opening ON games (username, opening_name, result);
+CREATE INDEX IF NOT EXISTS games_result ON games (username, result);
+CREATE TABLE IF NOT EXISTS ingests (
+    username TEXT PRIMARY KEY,
+    last_played_at INTEGER NOT NULL
+);
+"""
+
+
+def player_name(player: dict) -> str:
+    if player.get("aiLevel"):
+        return f"AI lvl {player['aiLevel']}"
+    return player.get("user", {}).get("name", "Anonymous")
+
+
+def game_row(username: str, game: dict) -> Optional[tuple]:
+    """
+    Flatten an exported game into a games row from the point of view of
+    username.
+
+    Returns:
+    - the row, or None for games that were never played out or that
+      username did not play.
+    """
+    if game.get("status") in NOT_PLAYED:
+        return None
+    players = game["players"]
+    # AI and anonymous players have no user, so look for username on both
+    # sides instead of assuming black whenever white does not match.
+    for color in ("white", "black"):
+        if players[color].get("user", {}).get("id") == username.lower():
+            break
+    else:
+        return None
+    other = "black" if color == "white" else "white"
+    if game.get("winner") is None:
+        result = "draw"
+    else:
+        result = "win" if game["winner"] == color else "loss"
+    opening = game.get("opening") or {}
+    return (
+        game["id"],
+        username,
+        game["createdAt"],
+        color,
+        player_name(players[other]),
+        result,
+        opening.get("eco"),
+        opening.get("name"),
+        game.get("speed"),
+        int(bool(game.get("rated"))),
+    )
+
+
+class HistoryStore:
+    """
+    SQLite store of the game history of Lichess users, indexed on player,
+    date, opening and result.
+
+    Every call opens its own connection so the store can be used from
+    worker threads and several processes on the same machine.
+    """
+
+    def __init__(self, path: str = HISTORY_DB):
+        self.path = path
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def last_played_at(self, username: str) -> Optional[int]:
+        with self.connect() as db:
+            row = db.execute(
+                "SELECT last_played_at FROM ingests WHERE username = ?", (username,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def insert(self, rows: list[tuple]) -> None:
+        with self.connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def mark_ingested(self, username: str, last_played_at: int) -> None:
+        with self.connect() as db:
+            db.execute(
+                "INSERT INTO ingests VALUES (?, ?) ON CONFLICT (username) "
+                "DO UPDATE SET last_played_at = MAX(last_played_at, excluded.last_played_at)",
+                (username, last_played_at),
+            )
+
+    def stats(self, username: str, opening: Optional[str] = None) -> dict:
+        """
+        Aggregate the stored games of a user.
+
+        Args:
+        - username: Lichess username.
+        - opening: only count openings whose name contains this text.
+
+        Returns:
+        - {"results": {result: count}, "openings": [(name, games, wins)]}
+          with the five most played openings.
+        """
+        where, params = "username = ?", [username.lower()]
+        if opening:
+            where += " AND opening_name LIKE ?"
+            params.append(f"%{opening}%")
+        with self.connect() as db:
+            results = dict(
+                db.execute(
+                    f"SELECT result, COUNT(*) FROM games WHERE {where} GROUP BY result",
+                    params,
+                ).fetchall()
+            )
+            openings = db.execute(
+                f"SELECT opening_name, COUNT(*), SUM(result = 'win') FROM games "
+                f"WHERE {where} AND opening_name IS NOT NULL "
+                "GROUP BY opening_name ORDER BY COUNT(*) DESC LIMIT 5",
+                params,
+            ).fetchall()
+        return {"results": results, "openings": openings}
+
+    async def ingest(self, lichess: LichessClient, token: str, username: str) -> int:
+        """
+        Stream the games of a user played since the last ingest into the store.
+
+        The NDJSON export is consumed as it arrives and written in batches of
+        HISTORY_BATCH games, the whole history is never held in memory.
+
+        Args:
+        - lichess: client used for the export.
+        - token: bearer token of the user.
+        - username: Lichess username.
+
+        Returns:
+        - the number of stored games.
+        """
+        username = username.lower()
+        last = await asyncio.to_thread(self.last_played_at, username)
+        since = last + 1 if last is not None else None
+        rows, stored, newest = [], 0, last or 0
+        async for game in lichess.stream_user_games(token, username, since):
+            row = game_row(username, game)
+            if row is None:
+                continue
+            rows.append(row)
+            newest = max(newest, row[2])
+            if len(rows) >= HISTORY_BATCH:
+                await asyncio.to_thread(self.insert, rows)
+                stored, rows = stored + len(rows), []
+        if rows:
+            await asyncio.to_thread(self.insert, rows)
+            stored += len(rows)
+        if newest:
+            await asyncio.to_thread(self.mark_ingested, username, newest)
+        return stored
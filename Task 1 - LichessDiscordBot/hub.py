@@ -0,0 +1,445 @@
+import asyncio
+import os
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, Hashable, Optional
+
+import aiohttp
+import chess
+import discord
+
+from board import LiveBoard, board_text
+from editor import ChannelBucket, MessageEditor
+from engine import ENGINE_STREAM_DEPTH, EnginePool, EngineUnavailable, eval_bar
+from lichess import LichessClient, LichessError, RateLimited
+from render_service import RenderService
+
+STREAM_RETRY_MIN = float(os.getenv("STREAM_RETRY_MIN", 1))
+STREAM_RETRY_MAX = float(os.getenv("STREAM_RETRY_MAX", 60))
+BOARD_MODES = {"image", "text"}
+STREAM_BOARD_MODE = os.getenv("STREAM_BOARD_MODE", "image").lower()
+if STREAM_BOARD_MODE not in BOARD_MODES:
+    print(f"Unknown STREAM_BOARD_MODE {STREAM_BOARD_MODE!r}, using image")
+    STREAM_BOARD_MODE = "image"
+
+UNFINISHED = {None, "created", "started"}
+VALIDATED_VARIANTS = {"standard", "chess960", "fromPosition"}
+
+
+class GameStream:
+    """
+    Single upstream subscription to a game, fanned out to every Discord
+    message showing it.
+
+    Each state is rendered once, and only when the position changed, then
+    handed to the MessageEditor of every subscribed message. Messages in
+    text mode get the board as text in the embed, and the image is only
+    rendered while a message in image mode shows the game. Messages with
+    an eval bar are edited again once the engine evaluated the position. A
+    dropped upstream connection is reopened with exponential backoff.
+    """
+
+    def __init__(self, hub: "StreamHub", game_id: str, token: str):
+        self.hub = hub
+        self.game_id = game_id
+        self.token = token
+        self.editors = {}
+        self.live_board = LiveBoard()
+        self.players = None
+        self.player_ids = {}
+        self.variant = None
+        self.key = None
+        self.png = None
+        self.text = None
+        self.evaluation = None
+        self.eval_task = None
+        self.image_task = None
+        self.task = None
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def follow(self) -> None:
+        """Consume the game stream until the game ends, reconnecting on drops."""
+        delay = STREAM_RETRY_MIN
+        while True:
+            try:
+                async for event in self.hub.lichess.stream_game_state(
+                    self.token, self.game_id
+                ):
+                    delay = STREAM_RETRY_MIN
+                    if await self.handle(event):
+                        return
+            except (aiohttp.ClientError, asyncio.TimeoutError, RateLimited) as e:
+                print(f"Stream of game {self.game_id} dropped: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STREAM_RETRY_MAX)
+
+    async def run(self) -> None:
+        try:
+            await self.follow()
+        except LichessError as e:
+            print(e)
+            self.broadcast(
+                ("error", str(e)),
+                embed=discord.Embed(
+                    title="Error Streaming Game",
+                    description="Invalid game ID provided.",
+                    color=discord.Color.red(),
+                ),
+            )
+        except asyncio.CancelledError:
+            for editor in self.editors.values():
+                editor.cancel()
+            if self.hub.streams.get(self.game_id) is self:
+                del self.hub.streams[self.game_id]
+            raise
+        except Exception as e:
+            # Leave like a finished game, or the records left in Redis would
+            # reopen the stream on every sync.
+            print(f"Stream of game {self.game_id} failed: {e!r}")
+        finally:
+            for task in (self.eval_task, self.image_task):
+                if task is not None:
+                    task.cancel()
+        await asyncio.gather(*[editor.flush() for editor in self.editors.values()])
+        await self.hub.finish(self)
+
+    async def handle(self, event: dict) -> bool:
+        """
+        Apply one upstream event.
+
+        Args:
+        - event: decoded game stream event.
+
+        Returns:
+        - whether the game is over and the stream should stop.
+        """
+        print(event)
+        if event["type"] == "gameFull":
+            white = event["white"].get("name") or f"AI lvl {event['white']['aiLevel']}"
+            black = event["black"].get("name") or f"AI lvl {event['black']['aiLevel']}"
+            if self.players is None:
+                self.players = f"White: {white}\nBlack: {black}"
+                await self.announce(self.players)
+            self.player_ids = {
+                chess.WHITE: event["white"].get("id"),
+                chess.BLACK: event["black"].get("id"),
+            }
+            self.variant = event.get("variant", {}).get("key")
+            self.live_board = LiveBoard(
+                event.get("initialFen", "startpos"),
+                chess960=self.variant == "chess960",
+            )
+            event = event["state"]
+        if event.get("status") not in UNFINISHED:
+            result = f"Game over! {event['status'].capitalize()}."
+            if event.get("winner"):
+                result += f" Winner: {event['winner']}."
+            # Every message, text boards included, ends on an image of the
+            # final position.
+            if "moves" in event:
+                self.live_board.update(event["moves"])
+            png = await self.render(self.live_board.board.board_fen())
+            self.broadcast(
+                ("result", result), embed=discord.Embed(title=result), png=png
+            )
+            return True
+        elif event.get("rematch", None):
+            self.broadcast(
+                ("rematch", event["rematch"]),
+                embed=discord.Embed(
+                    title="Rematch!",
+                    description="Join the new game!",
+                    url=f"https://lichess.org/{event['rematch']}",
+                ),
+            )
+            return True
+        if event.get("type") != "gameState":
+            return False
+        board = self.live_board.update(event.get("moves"))
+        if board.board_fen() == self.key:
+            return False
+        self.key, self.png, self.text = board.board_fen(), None, board_text(board)
+        self.evaluation = None
+        if self.eval_task is not None:
+            self.eval_task.cancel()
+            self.eval_task = None
+        # Text boards are edited before the image is rendered.
+        for editor in list(self.editors.values()):
+            self.show(editor)
+        self.request_evaluation()
+        await self.show_image(self.key)
+        return False
+
+    async def render(self, board_fen: str) -> Optional[bytes]:
+        try:
+            return await self.hub.render_service.render_board(board_fen)
+        except asyncio.TimeoutError:
+            print(f"Rendering timed out for game {self.game_id}")
+            return None
+        except BrokenProcessPool:
+            print(f"Render worker crashed for game {self.game_id}")
+            return None
+
+    async def show_image(self, key: str) -> None:
+        """Render a position for the messages in image mode, if there are any."""
+        if not any(editor.mode == "image" for editor in self.editors.values()):
+            return
+        png = await self.render(key)
+        if png is None or key != self.key:
+            return
+        self.png = png
+        for editor in list(self.editors.values()):
+            if editor.mode == "image":
+                self.show(editor)
+
+    def show(self, editor: MessageEditor) -> None:
+        """Submit the current board to one message."""
+        evaluation = self.evaluation if editor.eval_bar else None
+        if editor.mode == "text":
+            if self.text is None:
+                return
+            description = self.text
+            if evaluation is not None:
+                description += f"\n{eval_bar(evaluation)}"
+            editor.submit(
+                (self.key, "text", evaluation.score if evaluation else None),
+                embed=discord.Embed(
+                    title="Game in progress",
+                    description=description,
+                    color=discord.Color.green(),
+                ),
+            )
+        elif self.png is None:
+            return
+        elif evaluation is not None:
+            editor.submit(
+                (self.key, evaluation.score),
+                embed=discord.Embed(
+                    title="Game in progress",
+                    description=eval_bar(evaluation),
+                    color=discord.Color.green(),
+                ),
+                png=self.png,
+            )
+        else:
+            editor.submit(self.key, png=self.png)
+
+    def request_evaluation(self) -> None:
+        """Evaluate the current board if a message shows an eval bar."""
+        if (
+            self.evaluation is not None
+            or self.eval_task is not None
+            or not self.hub.engines.available
+            or not any(editor.eval_bar for editor in self.editors.values())
+        ):
+            return
+        self.eval_task = asyncio.create_task(
+            self.evaluate(self.live_board.board.copy(stack=False), self.key)
+        )
+
+    async def evaluate(self, board: chess.Board, key: str) -> None:
+        try:
+            evaluation = await self.hub.engines.evaluate(board, ENGINE_STREAM_DEPTH)
+        except EngineUnavailable:
+            return
+        finally:
+            if key == self.key:
+                self.eval_task = None
+        if key != self.key:
+            return
+        self.evaluation = evaluation
+        for editor in list(self.editors.values()):
+            if editor.eval_bar:
+                self.show(editor)
+
+    def check_move(self, username: str, text: str) -> Optional[str]:
+        """
+        Validate a move against the streamed position before it is sent.
+
+        Args:
+        - username: Lichess username of the player making the move.
+        - text: the move in UCI or SAN notation.
+
+        Returns:
+        - the move in UCI notation, or None if the position is not known
+          well enough to validate (before the first state, or a variant
+          with moves python-chess' standard board does not know).
+
+        Raises:
+        - ValueError with a message for the user if the move is rejected.
+        """
+        if self.variant not in VALIDATED_VARIANTS:
+            return None
+        board = self.live_board.board
+        if self.player_ids.get(board.turn) != username.lower():
+            raise ValueError("It is not your turn.")
+        try:
+            return self.live_board.parse_move(text).uci()
+        except chess.AmbiguousMoveError:
+            raise ValueError(f"`{text}` is ambiguous in this position.")
+        except ValueError:
+            raise ValueError(f"`{text}` is not a legal move in this position.")
+
+    async def announce(self, text: str) -> None:
+        """Send a message once to every channel showing the game."""
+        channels = {
+            editor.message.channel.id: editor.message.channel
+            for editor in self.editors.values()
+        }
+        await asyncio.gather(
+            *[channel.send(text) for channel in channels.values()],
+            return_exceptions=True,
+        )
+
+    def broadcast(
+        self,
+        key: Hashable,
+        embed: Optional[discord.Embed] = None,
+        png: Optional[bytes] = None,
+    ) -> None:
+        for editor in list(self.editors.values()):
+            editor.submit(key, embed, png)
+
+
+class StreamHub:
+    """
+    Keeps one GameStream per game id, reference counted by the messages
+    subscribed to it. The upstream stream is torn down when the last
+    subscriber leaves.
+    """
+
+    def __init__(
+        self,
+        lichess: LichessClient,
+        render_service: RenderService,
+        engines: EnginePool,
+        on_leave: Callable[[str, discord.Message], None] = lambda *_: None,
+        on_finish: Optional[Callable[[str, list[int]], Awaitable[None]]] = None,
+    ):
+        self.lichess = lichess
+        self.render_service = render_service
+        self.engines = engines
+        self.on_leave = on_leave
+        self.on_finish = on_finish
+        self.streams = {}
+        self.buckets = {}
+
+    async def subscribe(
+        self,
+        game_id: str,
+        token: str,
+        message: discord.Message,
+        eval_bar: bool = False,
+        mode: str = STREAM_BOARD_MODE,
+    ) -> GameStream:
+        """
+        Show a game in a message, starting the upstream stream if needed.
+
+        Args:
+        - game_id: Lichess game id.
+        - token: bearer token used if a new upstream stream is opened.
+        - message: Discord message the board is rendered into.
+        - eval_bar: show a live engine evaluation under the board.
+        - mode: "image" to show the board as an image, "text" to show it
+          as text in the embed.
+
+        Returns:
+        - the shared stream of the game.
+        """
+        stream = self.streams.get(game_id)
+        if stream is None:
+            stream = GameStream(self, game_id, token)
+            self.streams[game_id] = stream
+            stream.start()
+        if mode not in BOARD_MODES:
+            mode = STREAM_BOARD_MODE
+        bucket = self.buckets.setdefault(message.channel.id, ChannelBucket())
+        editor = MessageEditor(
+            message,
+            bucket,
+            lambda gone: self.unsubscribe(game_id, gone),
+            eval_bar=eval_bar,
+            mode=mode,
+        )
+        announced = any(
+            other.message.channel.id == message.channel.id
+            for other in stream.editors.values()
+        )
+        stream.editors[message.id] = editor
+        if stream.players is not None and not announced:
+            await message.channel.send(stream.players)
+        if stream.key is not None:
+            stream.show(editor)
+            if mode == "image" and stream.png is None:
+                if stream.image_task is not None:
+                    stream.image_task.cancel()
+                stream.image_task = asyncio.create_task(stream.show_image(stream.key))
+            stream.request_evaluation()
+        return stream
+
+    def unsubscribe(self, game_id: str, message: discord.Message) -> None:
+        stream = self.streams.get(game_id)
+        if stream is None:
+            return
+        editor = stream.editors.pop(message.id, None)
+        if editor is None:
+            return
+        if editor.task is not asyncio.current_task():
+            editor.cancel()
+        self.on_leave(game_id, message)
+        if not stream.editors:
+            self.streams.pop(game_id, None)
+            stream.task.cancel()
+        self.release_bucket(message.channel.id)
+
+    def release_bucket(self, channel_id: int) -> None:
+        """Forget the edit bucket of a channel no stream message is in."""
+        if not any(
+            editor.message.channel.id == channel_id
+            for stream in self.streams.values()
+            for editor in stream.editors.values()
+        ):
+            self.buckets.pop(channel_id, None)
+
+    def unsubscribe_channel(self, game_id: str, channel_id: int) -> int:
+        stream = self.streams.get(game_id)
+        if stream is None:
+            return 0
+        messages = [
+            editor.message
+            for editor in stream.editors.values()
+            if editor.message.channel.id == channel_id
+        ]
+        for message in messages:
+            self.unsubscribe(game_id, message)
+        return len(messages)
+
+    async def finish(self, stream: GameStream) -> None:
+        """
+        Forget a stream whose game ended, after on_finish released its
+        messages. Dropping it first would let a sync in between find the
+        game without a stream and open it again.
+        """
+        if self.on_finish is not None:
+            await self.on_finish(stream.game_id, list(stream.editors))
+        if self.streams.get(stream.game_id) is stream:
+            del self.streams[stream.game_id]
+        for channel_id in {
+            editor.message.channel.id for editor in stream.editors.values()
+        }:
+            self.release_bucket(channel_id)
+
+    def drop(self, game_id: str) -> None:
+        """Stop streaming a game in this process without calling on_leave."""
+        stream = self.streams.pop(game_id, None)
+        if stream is not None:
+            stream.task.cancel()
+            for channel_id in {
+                editor.message.channel.id for editor in stream.editors.values()
+            }:
+                self.release_bucket(channel_id)
+
+    def close(self) -> None:
+        for game_id in list(self.streams):
+            self.drop(game_id)
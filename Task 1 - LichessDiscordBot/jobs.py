@@ -0,0 +1,157 @@
+import json
+import os
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+import store
+from models.data import Job, JobWaiter
+
+JOB_LEASE_TTL = float(os.getenv("JOB_LEASE_TTL", 30))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+
+QUEUE_KEY = "jobs:queue"
+
+ENQUEUE = """
+redis.call("SADD", KEYS[2], ARGV[4])
+if redis.call("EXISTS", KEYS[1]) == 1 then
+    return 0
+end
+redis.call("HSET", KEYS[1], "kind", ARGV[2], "payload", ARGV[3], "attempts", 0)
+redis.call("LPUSH", KEYS[3], ARGV[1])
+return 1
+"""
+
+FINISH = """
+local waiters = redis.call("SMEMBERS", KEYS[2])
+redis.call("DEL", KEYS[1], KEYS[2])
+redis.call("LREM", KEYS[3], 0, ARGV[1])
+return waiters
+"""
+
+
+def job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def waiters_key(job_id: str) -> str:
+    return f"job:{job_id}:waiters"
+
+
+def processing_key(worker_id: str) -> str:
+    return f"jobs:processing:{worker_id}"
+
+
+def heartbeat_key(worker_id: str) -> str:
+    return f"jobs:worker:{worker_id}"
+
+
+def parse_waiter(waiter: bytes) -> JobWaiter:
+    channel_id, message_id = waiter.decode("utf-8").split(":")
+    return JobWaiter(channel_id=int(channel_id), message_id=int(message_id))
+
+
+class JobQueue:
+    """
+    Durable queue of heavy jobs in Redis, shared by bot and worker processes.
+
+    A job is identified by what it computes, e.g. "replay:{game_id}", and
+    enqueueing a job that is already queued or running only adds the
+    waiting message to it. Workers move the jobs they run to their own
+    processing list and keep a heartbeat, the jobs of a worker whose
+    heartbeat expired are put back on the queue.
+    """
+
+    def __init__(self, redis: Optional[aioredis.Redis] = None):
+        self.redis = redis or store.r
+        self.enqueue_script = self.redis.register_script(ENQUEUE)
+        self.finish_script = self.redis.register_script(FINISH)
+
+    async def enqueue(self, job: Job, waiter: JobWaiter) -> bool:
+        """
+        Queue a job, or join the identical job already queued or running.
+
+        Args:
+        - job: the job to run.
+        - waiter: message to edit with the result.
+
+        Returns:
+        - whether a new job was queued.
+        """
+        return bool(
+            await self.enqueue_script(
+                keys=[job_key(job.job_id), waiters_key(job.job_id), QUEUE_KEY],
+                args=[
+                    job.job_id,
+                    job.kind,
+                    json.dumps(job.payload),
+                    f"{waiter.channel_id}:{waiter.message_id}",
+                ],
+            )
+        )
+
+    async def claim(self, worker_id: str, timeout: float) -> Optional[Job]:
+        """Wait up to timeout seconds for the next job and take it."""
+        job_id = await self.redis.blmove(
+            QUEUE_KEY, processing_key(worker_id), timeout, "RIGHT", "LEFT"
+        )
+        if job_id is None:
+            return None
+        job_id = job_id.decode("utf-8")
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hincrby(job_key(job_id), "attempts", 1)
+            pipe.hmget(job_key(job_id), "kind", "payload")
+            attempts, (kind, payload) = await pipe.execute()
+        if kind is None:
+            await self.redis.lrem(processing_key(worker_id), 0, job_id)
+            await self.redis.delete(job_key(job_id))
+            return None
+        return Job(
+            job_id=job_id,
+            kind=kind.decode("utf-8"),
+            payload=json.loads(payload),
+            attempts=attempts,
+        )
+
+    async def finish(self, worker_id: str, job: Job) -> list[JobWaiter]:
+        """
+        Remove a finished job.
+
+        Returns:
+        - every message waiting for it, including those that joined while
+          it ran.
+        """
+        waiters = await self.finish_script(
+            keys=[
+                job_key(job.job_id),
+                waiters_key(job.job_id),
+                processing_key(worker_id),
+            ],
+            args=[job.job_id],
+        )
+        return [parse_waiter(waiter) for waiter in waiters]
+
+    async def waiters(self, job_id: str) -> list[JobWaiter]:
+        return [
+            parse_waiter(waiter)
+            for waiter in await self.redis.smembers(waiters_key(job_id))
+        ]
+
+    async def heartbeat(self, worker_id: str) -> None:
+        await self.redis.set(heartbeat_key(worker_id), 1, px=int(JOB_LEASE_TTL * 1000))
+
+    async def recover(self) -> int:
+        """
+        Requeue the jobs of workers that stopped without finishing them.
+
+        Returns:
+        - the number of requeued jobs.
+        """
+        requeued = 0
+        async for key in self.redis.scan_iter(match=processing_key("*")):
+            worker_id = key.decode("utf-8").split(":", 2)[2]
+            if await self.redis.exists(heartbeat_key(worker_id)):
+                continue
+            while await self.redis.lmove(key, QUEUE_KEY, "RIGHT", "RIGHT"):
+                requeued += 1
+        return requeued
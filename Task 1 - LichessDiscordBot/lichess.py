@@ -0,0 +1,286 @@
+import json
+import os
+from typing import Any, AsyncIterator, Optional
+
+import aiohttp
+
+from ratelimit import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, RateLimiter
+
+LICHESS_HOST = os.getenv("LICHESS_HOST", "https://lichess.org")
+LICHESS_MAX_CONNECTIONS = int(os.getenv("LICHESS_MAX_CONNECTIONS", 100))
+LICHESS_TIMEOUT = float(os.getenv("LICHESS_TIMEOUT", 30))
+# Lichess sends a keep-alive newline every few seconds on open streams.
+LICHESS_STREAM_TIMEOUT = float(os.getenv("LICHESS_STREAM_TIMEOUT", 30))
+RETRY_AFTER = 60
+
+
+class LichessError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class RateLimited(LichessError):
+    def __init__(self):
+        super().__init__(429, "Too many requests to Lichess")
+
+
+def form(**params: Any) -> dict:
+    """Drop unset parameters and encode booleans the way Lichess expects."""
+    return {
+        key: str(value).lower() if isinstance(value, bool) else str(value)
+        for key, value in params.items()
+        if value is not None
+    }
+
+
+def retry_after(response: aiohttp.ClientResponse) -> float:
+    try:
+        return float(response.headers.get("Retry-After", RETRY_AFTER))
+    except ValueError:
+        return RETRY_AFTER
+
+
+class LichessClient:
+    """
+    Async Lichess API client shared by every user of the bot.
+
+    One keep-alive connection pool is used for all requests and each request
+    carries the bearer token of the user it is made for. Every request and
+    stream first takes a slot from the shared RateLimiter, and a 429 blocks
+    all requests for its Retry-After period before the request is retried.
+    """
+
+    def __init__(
+        self,
+        host: str = LICHESS_HOST,
+        max_connections: int = LICHESS_MAX_CONNECTIONS,
+        timeout: float = LICHESS_TIMEOUT,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        self.host = host
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.limiter = limiter or RateLimiter()
+        self.session = None
+
+    async def start(self) -> None:
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=self.max_connections, keepalive_timeout=60
+            ),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def throttle(self, token: Optional[str], priority: int) -> None:
+        if not await self.limiter.acquire(token, priority):
+            raise RateLimited()
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        token: Optional[str],
+        priority: int = PRIORITY_NORMAL,
+        **kwargs: Any,
+    ) -> Optional[dict]:
+        if self.session is None:
+            await self.start()
+        headers = {"Accept": "application/json"}
+        if token is not None:
+            headers["Authorization"] = f"Bearer {token}"
+        while True:
+            await self.throttle(token, priority)
+            async with self.session.request(
+                method, f"{self.host}{path}", headers=headers, **kwargs
+            ) as response:
+                if response.status == 429:
+                    await self.limiter.block(retry_after(response))
+                    continue
+                if response.status >= 400:
+                    raise LichessError(response.status, await response.text())
+                return await response.json(content_type=None)
+
+    async def stream(
+        self,
+        path: str,
+        token: str,
+        priority: int = PRIORITY_NORMAL,
+        **kwargs: Any,
+    ) -> AsyncIterator[dict]:
+        """
+        Yield the objects of an NDJSON stream as they arrive.
+
+        Args:
+        - path: API path of the stream.
+        - token: bearer token of the user.
+        - priority: rate limiter priority of opening the stream.
+
+        Returns:
+        - async iterator of decoded events, keep-alive newlines and
+          undecodable lines are skipped. A stream silent for
+          LICHESS_STREAM_TIMEOUT seconds raises aiohttp.ServerTimeoutError.
+        """
+        if self.session is None:
+            await self.start()
+        await self.throttle(token, priority)
+        async with self.session.get(
+            f"{self.host}{path}",
+            headers={
+                "Authorization": f"Bearer {token}",
+                "Accept": "application/x-ndjson",
+            },
+            timeout=aiohttp.ClientTimeout(total=None, sock_read=LICHESS_STREAM_TIMEOUT),
+            **kwargs,
+        ) as response:
+            if response.status == 429:
+                await self.limiter.block(retry_after(response))
+                raise RateLimited()
+            if response.status >= 400:
+                raise LichessError(response.status, await response.text())
+            async for line in response.content:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Skipped undecodable line from {path}: {line[:100]!r}")
+                    continue
+                yield event
+
+    async def exchange_code(
+        self,
+        code: str,
+        code_verifier: str,
+        redirect_uri: str,
+        client_id: str,
+        client_secret: Optional[str] = None,
+    ) -> dict:
+        """Trade an OAuth authorization code for an access token (PKCE)."""
+        return await self.request(
+            "POST",
+            "/api/token",
+            None,
+            data=form(
+                grant_type="authorization_code",
+                code=code,
+                code_verifier=code_verifier,
+                redirect_uri=redirect_uri,
+                client_id=client_id,
+                client_secret=client_secret,
+            ),
+        )
+
+    async def get_account(self, token: str) -> dict:
+        return await self.request("GET", "/api/account", token)
+
+    async def create_ai_challenge(
+        self,
+        token: str,
+        level: int,
+        clock_limit: Optional[int] = None,
+        clock_increment: Optional[int] = None,
+        color: Optional[str] = None,
+        variant: Optional[str] = None,
+    ) -> dict:
+        return await self.request(
+            "POST",
+            "/api/challenge/ai",
+            token,
+            data=form(
+                level=level,
+                **{"clock.limit": clock_limit, "clock.increment": clock_increment},
+                color=color,
+                variant=variant,
+            ),
+        )
+
+    async def create_challenge(
+        self,
+        token: str,
+        username: str,
+        rated: bool = False,
+        clock_limit: Optional[int] = None,
+        clock_increment: Optional[int] = None,
+        color: Optional[str] = None,
+        variant: Optional[str] = None,
+    ) -> dict:
+        return await self.request(
+            "POST",
+            f"/api/challenge/{username}",
+            token,
+            data=form(
+                rated=rated,
+                **{"clock.limit": clock_limit, "clock.increment": clock_increment},
+                color=color,
+                variant=variant,
+            ),
+        )
+
+    async def get_challenges(self, token: str) -> dict:
+        return await self.request("GET", "/api/challenge", token)
+
+    async def accept_challenge(self, token: str, challenge_id: str) -> None:
+        await self.request("POST", f"/api/challenge/{challenge_id}/accept", token)
+
+    async def decline_challenge(
+        self, token: str, challenge_id: str, reason: str = "generic"
+    ) -> None:
+        await self.request(
+            "POST",
+            f"/api/challenge/{challenge_id}/decline",
+            token,
+            data=form(reason=reason),
+        )
+
+    async def export_game(self, token: str, game_id: str) -> dict:
+        return await self.request(
+            "GET", f"/game/export/{game_id}", token, priority=PRIORITY_LOW
+        )
+
+    async def make_move(self, token: str, game_id: str, move: str) -> None:
+        await self.request(
+            "POST",
+            f"/api/board/game/{game_id}/move/{move}",
+            token,
+            priority=PRIORITY_HIGH,
+        )
+
+    async def resign_game(self, token: str, game_id: str) -> None:
+        await self.request(
+            "POST",
+            f"/api/board/game/{game_id}/resign",
+            token,
+            priority=PRIORITY_HIGH,
+        )
+
+    async def offer_draw(self, token: str, game_id: str) -> None:
+        await self.request(
+            "POST",
+            f"/api/board/game/{game_id}/draw/yes",
+            token,
+            priority=PRIORITY_HIGH,
+        )
+
+    def stream_game_state(self, token: str, game_id: str) -> AsyncIterator[dict]:
+        return self.stream(f"/api/board/game/stream/{game_id}", token)
+
+    def stream_incoming_events(self, token: str) -> AsyncIterator[dict]:
+        return self.stream("/api/stream/event", token)
+
+    def stream_user_games(
+        self, token: str, username: str, since: Optional[int] = None
+    ) -> AsyncIterator[dict]:
+        return self.stream(
+            f"/api/games/user/{username}",
+            token,
+            priority=PRIORITY_LOW,
+            params=form(since=since, moves=False, opening=True),
+        )
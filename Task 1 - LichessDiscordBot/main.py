@@ -1,18 +1,52 @@
+import multiprocessing
 import os
+from typing import Optional
 
-from bot import Chessify
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from bot import Chessify
+
 TOKEN = os.getenv("DISCORD_TOKEN")
-bot = Chessify()
-bot.run(TOKEN)
-# import redis
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 1))
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0)) or None
+SHARD_IDS = os.getenv("SHARD_IDS")
 
 
-# r = redis.Redis(host="localhost", port=6379, db=0)
+def run(shard_ids: Optional[list[int]], shard_count: Optional[int]) -> None:
+    bot = Chessify(
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        sync_commands=shard_ids is None or 0 in shard_ids,
+    )
+    bot.run(TOKEN)
 
 
-# print(r.get("game_1302997915576569938").decode("utf-8"))
-# print(r.get("game_433582252790906891").decode("utf-8"))
+if __name__ == "__main__":
+    if SHARD_IDS and SHARD_COUNT is None:
+        # The other machines run the remaining shards, so the total cannot be
+        # told from the shards of this one.
+        raise SystemExit("SHARD_COUNT must be set when SHARD_IDS is")
+    if BOT_WORKERS == 1 and SHARD_IDS is None:
+        run(None, SHARD_COUNT)
+    else:
+        # Every worker process needs the total shard count to connect its
+        # share of the shards, the shards of this machine are split evenly.
+        shard_count = SHARD_COUNT or BOT_WORKERS
+        shard_ids = (
+            [int(shard) for shard in SHARD_IDS.split(",")]
+            if SHARD_IDS
+            else list(range(shard_count))
+        )
+        if max(shard_ids) >= shard_count:
+            raise SystemExit(f"SHARD_IDS must be below SHARD_COUNT ({shard_count})")
+        context = multiprocessing.get_context("spawn")
+        workers = [
+            context.Process(target=run, args=(shard_ids[i::BOT_WORKERS], shard_count))
+            for i in range(min(BOT_WORKERS, len(shard_ids)))
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
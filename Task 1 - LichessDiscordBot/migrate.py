@@ -0,0 +1,88 @@
+import json
+import re
+
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from store import REDIS_URL, auth_fields, challenge_key, user_key
+from models.data import Auth
+
+AUTH = re.compile(rb"^auth_(\d+)$")
+GAME = re.compile(rb"^game_(\d+)$")
+CHALLENGE = re.compile(rb"^challenge_message_(\d+)$")
+OLD_CHALLENGE = re.compile(rb"^challenge_(?!message_)\w+$")
+
+
+def migrate_auth(r: redis.Redis, key: bytes) -> None:
+    data, ttl = r.get(key), r.pttl(key)
+    if data is None:
+        return
+    auth = Auth(**json.loads(data.decode("utf-8")))
+    with r.pipeline(transaction=True) as pipe:
+        pipe.hset(user_key(auth.discord_id), mapping=auth_fields(auth))
+        if ttl > 0:
+            pipe.pexpire(user_key(auth.discord_id), ttl)
+        pipe.delete(key)
+        pipe.execute()
+
+
+def migrate_game(r: redis.Redis, key: bytes, user_id: str) -> None:
+    game_id = r.get(key)
+    with r.pipeline(transaction=True) as pipe:
+        if game_id is not None and r.exists(user_key(user_id)):
+            pipe.hset(user_key(user_id), "game_id", game_id)
+        pipe.delete(key)
+        pipe.execute()
+
+
+def migrate_challenge(r: redis.Redis, key: bytes, message_id: str) -> None:
+    data, ttl = r.get(key), r.pttl(key)
+    with r.pipeline(transaction=True) as pipe:
+        if data is not None:
+            pipe.hset(challenge_key(message_id), mapping=json.loads(data))
+            if ttl > 0:
+                pipe.pexpire(challenge_key(message_id), ttl)
+        pipe.delete(key)
+        pipe.execute()
+
+
+def migrate(r: redis.Redis) -> dict:
+    """
+    Convert the string keys of the old schema into the user and challenge
+    hashes read by store.
+
+    Auth keys are migrated first so current games are only kept for users
+    that are still logged in. Challenges from before the message id index
+    cannot be answered anymore and are dropped.
+
+    Args:
+    - r: Redis connection.
+
+    Returns:
+    - number of migrated keys by kind.
+    """
+    counts = {"auth": 0, "game": 0, "challenge": 0, "dropped": 0}
+    for key in list(r.scan_iter(match="auth_*")):
+        if AUTH.match(key):
+            migrate_auth(r, key)
+            counts["auth"] += 1
+    for key in list(r.scan_iter(match="game_*")):
+        match = GAME.match(key)
+        if match:
+            migrate_game(r, key, match.group(1).decode("utf-8"))
+            counts["game"] += 1
+    for key in list(r.scan_iter(match="challenge_*")):
+        match = CHALLENGE.match(key)
+        if match:
+            migrate_challenge(r, key, match.group(1).decode("utf-8"))
+            counts["challenge"] += 1
+        elif OLD_CHALLENGE.match(key):
+            r.delete(key)
+            counts["dropped"] += 1
+    return counts
+
+
+if __name__ == "__main__":
+    print(migrate(redis.Redis.from_url(REDIS_URL)))
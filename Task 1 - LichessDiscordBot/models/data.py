@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass
@@ -6,3 +7,48 @@ class Auth:
     discord_id: int
     token: str
     lichess_username: str
+
+
+@dataclass
+class Challenge:
+    challenge_id: str
+    message_id: int
+    user_id: int
+    opponent_id: int
+
+
+@dataclass
+class StreamRecord:
+    game_id: str
+    channel_id: int
+    message_id: int
+    user_id: int
+    eval_bar: bool = False
+    mode: str = "image"
+
+
+@dataclass
+class Login:
+    discord_id: int
+    code_verifier: str
+
+
+@dataclass
+class Job:
+    job_id: str
+    kind: str
+    payload: dict
+    attempts: int = 0
+
+
+@dataclass
+class JobWaiter:
+    channel_id: int
+    message_id: int
+
+
+@dataclass
+class Evaluation:
+    depth: int
+    score: int
+    best: Optional[str] = None
@@ -0,0 +1,9 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Theme:
+    light: str = "#ffffff"
+    dark: str = "#808080"
+    background: str = "#ffffff"
+    text: str = "#000000"
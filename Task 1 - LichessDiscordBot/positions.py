@@ -0,0 +1,292 @@
+import contextlib
+import fcntl
+import json
+import os
+import threading
+from typing import Iterator, Optional
+
+import chess
+import chess.polyglot
+import numpy as np
+
+POSITION_INDEX_DIR = os.getenv(
+    "POSITION_INDEX_DIR", os.path.join(os.path.dirname(__file__), ".positions")
+)
+POSITION_MAX_SEGMENTS = int(os.getenv("POSITION_MAX_SEGMENTS", 8))
+
+INDEXED_VARIANTS = {"standard", "chess960", "fromPosition"}
+NO_MOVE = 0xFFFF
+RESULTS = {None: 0, "white": 1, "black": 2}
+
+# One row per position reached in a game: the Zobrist key of the position,
+# the game number, the ply and the move played next.
+ENTRY = np.dtype([("key", "<u8"), ("game", "<u4"), ("ply", "<u2"), ("move", "<u2")])
+
+
+def encode_move(move: chess.Move) -> int:
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def decode_move(value: int) -> chess.Move:
+    return chess.Move(value & 63, value >> 6 & 63, value >> 12 or None)
+
+
+def game_entries(game: dict, number: int) -> Optional[np.ndarray]:
+    """
+    Hash every position of an exported game.
+
+    Args:
+    - game: game as returned by the Lichess export, with san moves.
+    - number: number of the game in the index.
+
+    Returns:
+    - the entries of the game, or None if its variant or moves cannot be
+      indexed.
+    """
+    variant = game.get("variant", "standard")
+    if variant not in INDEXED_VARIANTS:
+        return None
+    board = chess.Board(
+        game.get("initialFen", chess.STARTING_FEN), chess960=variant == "chess960"
+    )
+    moves = game.get("moves", "").split()
+    entries = np.empty(len(moves) + 1, dtype=ENTRY)
+    try:
+        for ply, san in enumerate(moves):
+            move = board.parse_san(san)
+            entries[ply] = (
+                chess.polyglot.zobrist_hash(board),
+                number,
+                ply,
+                encode_move(move),
+            )
+            board.push(move)
+    except ValueError:
+        return None
+    entries[len(moves)] = (
+        chess.polyglot.zobrist_hash(board),
+        number,
+        len(moves),
+        NO_MOVE,
+    )
+    return entries
+
+
+class PositionIndex:
+    """
+    On-disk index from Zobrist position keys to the games reaching them.
+
+    Entries live in sorted numpy segments that are memory mapped for
+    lookups, a lookup is one binary search per segment. New games are
+    written as a new segment and the segments are merged once there are
+    more than max_segments of them. A manifest replaced atomically lists
+    the live segments, so readers in other processes pick up appends
+    without locking.
+    """
+
+    def __init__(
+        self,
+        directory: str = POSITION_INDEX_DIR,
+        max_segments: int = POSITION_MAX_SEGMENTS,
+    ):
+        self.directory = directory
+        self.max_segments = max_segments
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_version = None
+        self.segments = {}
+        self.games = []
+        self.game_numbers = {}
+        self.games_offset = 0
+        self.results = np.empty(0, dtype=np.uint8)
+        self.lock = threading.Lock()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def read_manifest(self) -> dict:
+        try:
+            with open(self.path("manifest.json")) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {"segments": [], "games": 0, "next": 0}
+
+    def write_manifest(self, manifest: dict) -> None:
+        tmp = self.path(f"manifest.{os.getpid()}.tmp")
+        with open(tmp, "w") as file:
+            json.dump(manifest, file)
+        os.replace(tmp, self.path("manifest.json"))
+
+    def refresh(self) -> None:
+        """Load segments and games added since the last call."""
+        with self.lock:
+            self.load()
+
+    def load(self) -> None:
+        while True:
+            try:
+                stat = os.stat(self.path("manifest.json"))
+            except FileNotFoundError:
+                return
+            # The manifest is replaced, not rewritten, so its inode changes
+            # even when two writes land within the same mtime tick.
+            version = (stat.st_ino, stat.st_mtime_ns)
+            if version == self.manifest_version:
+                return
+            manifest = self.read_manifest()
+            try:
+                self.segments = {
+                    name: (
+                        self.segments[name]
+                        if name in self.segments
+                        else np.load(self.path(name), mmap_mode="r")
+                    )
+                    for name in manifest["segments"]
+                }
+            except FileNotFoundError:
+                # A merge removed the segments of the manifest just read.
+                continue
+            self.manifest_version = version
+            break
+        results = []
+        with open(self.path("games.jsonl"), "rb") as file:
+            file.seek(self.games_offset)
+            while len(self.games) < manifest["games"]:
+                line = file.readline()
+                record = json.loads(line)
+                self.game_numbers[record["id"]] = len(self.games)
+                self.games.append(record)
+                self.games_offset += len(line)
+                results.append(RESULTS[record["winner"]])
+        self.results = np.concatenate([self.results, np.array(results, dtype=np.uint8)])
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator[None]:
+        with open(self.path("lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def add_games(self, games: list[dict]) -> int:
+        """
+        Append finished games that are not indexed yet.
+
+        Args:
+        - games: games as returned by the Lichess export.
+
+        Returns:
+        - the number of games added.
+        """
+        with self.locked():
+            self.refresh()
+            manifest = self.read_manifest()
+            records, entries = [], []
+            for game in games:
+                if game["id"] in self.game_numbers:
+                    continue
+                game_entries_ = game_entries(game, manifest["games"] + len(records))
+                if game_entries_ is None:
+                    continue
+                records.append({"id": game["id"], "winner": game.get("winner")})
+                entries.append(game_entries_)
+            if not records:
+                return 0
+            segment = np.sort(np.concatenate(entries), order="key", kind="stable")
+            name = f"segment-{manifest['next']}.npy"
+            np.save(self.path(name), segment)
+            # Drop records a crashed writer appended without committing them
+            # to the manifest, they would shift the number of every game.
+            with open(self.path("games.jsonl"), "a") as file:
+                file.truncate(self.games_offset)
+                file.writelines(json.dumps(record) + "\n" for record in records)
+            manifest["segments"].append(name)
+            manifest["games"] += len(records)
+            manifest["next"] += 1
+            if len(manifest["segments"]) > self.max_segments:
+                self.merge(manifest)
+            self.write_manifest(manifest)
+            self.refresh()
+            return len(records)
+
+    def merge(self, manifest: dict) -> None:
+        old = manifest["segments"]
+        merged = np.sort(
+            np.concatenate([np.load(self.path(name)) for name in old]),
+            order="key",
+            kind="stable",
+        )
+        name = f"segment-{manifest['next']}.npy"
+        np.save(self.path(name), merged)
+        manifest["segments"] = [name]
+        manifest["next"] += 1
+        for name in old:
+            os.remove(self.path(name))
+
+    def find(self, key: int) -> np.ndarray:
+        self.refresh()
+        found = []
+        for segment in self.segments.values():
+            keys = segment["key"]
+            lo = np.searchsorted(keys, key, "left")
+            hi = np.searchsorted(keys, key, "right")
+            if hi > lo:
+                found.append(np.asarray(segment[lo:hi]))
+        return np.concatenate(found) if found else np.empty(0, dtype=ENTRY)
+
+    def lookup(self, board: chess.Board, limit: int = 10) -> dict:
+        """
+        Games reaching a position and the moves played from it.
+
+        Args:
+        - board: the position.
+        - limit: maximum number of game ids returned.
+
+        Returns:
+        - {"total": games reaching the position, "games": [game ids],
+          "moves": [(san, games, white wins, draws, black wins)]} with the
+          most played moves first.
+        """
+        entries = self.find(chess.polyglot.zobrist_hash(board))
+        numbers = np.unique(entries["game"])
+        played = entries[entries["move"] != NO_MOVE]
+        # A game reaching the position again counts once per move played
+        # from it.
+        games_moves = np.unique(
+            played["game"].astype(np.uint64) << 16 | played["move"].astype(np.uint64)
+        )
+        games, played_moves = games_moves >> 16, games_moves & 0xFFFF
+        # Count (move, result) pairs in one pass, results are 0 for a draw,
+        # 1 for a white win and 2 for a black win.
+        pairs, counts = np.unique(
+            played_moves * 3 + self.results[games],
+            return_counts=True,
+        )
+        moves = {}
+        for pair, count in zip(pairs.tolist(), counts.tolist()):
+            move = decode_move(pair // 3)
+            if board.is_legal(move):
+                moves.setdefault(move, [0, 0, 0])[pair % 3] += count
+        return {
+            "total": len(numbers),
+            "games": [self.games[number]["id"] for number in numbers[:limit].tolist()],
+            "moves": sorted(
+                (
+                    (board.san(move), sum(results), results[1], results[0], results[2])
+                    for move, results in moves.items()
+                ),
+                key=lambda row: -row[1],
+            ),
+        }
+
+
+if __name__ == "__main__":
+    from replay_cache import REPLAY_CACHE_DIR
+
+    index = PositionIndex()
+    games = []
+    for entry in os.scandir(REPLAY_CACHE_DIR):
+        if entry.name.endswith(".json"):
+            with open(entry.path) as file:
+                games.append(json.load(file))
+    print(f"Indexed {index.add_games(games)} cached games")
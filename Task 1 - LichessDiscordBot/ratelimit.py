@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import Counter
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+import store
+
+LICHESS_RATE = float(os.getenv("LICHESS_RATE", 8))
+LICHESS_BURST = int(os.getenv("LICHESS_BURST", 16))
+LICHESS_TOKEN_RATE = float(os.getenv("LICHESS_TOKEN_RATE", 2))
+LICHESS_TOKEN_BURST = int(os.getenv("LICHESS_TOKEN_BURST", 4))
+LICHESS_QUEUE_TIMEOUT = float(os.getenv("LICHESS_QUEUE_TIMEOUT", 30))
+
+BLOCKED_KEY = "ratelimit:blocked"
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+# Share of each bucket a priority leaves untouched for the ones above it.
+RESERVE = {PRIORITY_HIGH: 0, PRIORITY_NORMAL: 0.25, PRIORITY_LOW: 0.5}
+
+TAKE = """
+local blocked = redis.call("PTTL", KEYS[1])
+if blocked > 0 then
+    return blocked
+end
+local time = redis.call("TIME")
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local reserve = tonumber(ARGV[1])
+local wait = 0
+local levels = {}
+for i = 2, #KEYS do
+    local rate = tonumber(ARGV[2 * i - 2]) / 1000
+    local burst = tonumber(ARGV[2 * i - 1])
+    local state = redis.call("HMGET", KEYS[i], "tokens", "updated")
+    local tokens = tonumber(state[1]) or burst
+    local updated = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+    levels[i] = tokens
+    local need = 1 + reserve * burst
+    if tokens < need then
+        wait = math.max(wait, math.ceil((need - tokens) / rate))
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i = 2, #KEYS do
+    local rate = tonumber(ARGV[2 * i - 2]) / 1000
+    local burst = tonumber(ARGV[2 * i - 1])
+    redis.call("HSET", KEYS[i], "tokens", tostring(levels[i] - 1), "updated", now)
+    redis.call("PEXPIRE", KEYS[i], math.ceil(burst / rate) + 1000)
+end
+return 0
+"""
+
+
+def bucket_key(token: str) -> str:
+    return f"ratelimit:{hashlib.sha256(token.encode('utf-8')).hexdigest()[:16]}"
+
+
+class RateLimiter:
+    """
+    Token buckets in Redis limiting the Lichess requests of every process
+    using the same Redis, globally and per user token.
+
+    Waiting requests are served highest priority first. Lower priorities
+    also leave a share of each bucket to the higher ones, so moves still go
+    through while exports drain the budget. A 429 blocks every process for
+    the Retry-After period. If Redis is unreachable, requests are let through.
+    """
+
+    def __init__(
+        self,
+        rate: float = LICHESS_RATE,
+        burst: int = LICHESS_BURST,
+        token_rate: float = LICHESS_TOKEN_RATE,
+        token_burst: int = LICHESS_TOKEN_BURST,
+        redis: Optional[aioredis.Redis] = None,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.token_rate = token_rate
+        self.token_burst = token_burst
+        self.redis = redis or store.r
+        self.take = self.redis.register_script(TAKE)
+        self.waiting = Counter()
+
+    async def acquire(
+        self,
+        token: Optional[str],
+        priority: int = PRIORITY_NORMAL,
+        timeout: float = LICHESS_QUEUE_TIMEOUT,
+    ) -> bool:
+        """
+        Wait for a slot to send one request.
+
+        Args:
+        - token: bearer token the request is sent with, if any.
+        - priority: PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW.
+        - timeout: seconds to wait at most.
+
+        Returns:
+        - whether a slot was taken, False if none is free within timeout.
+        """
+        keys, args = [BLOCKED_KEY, "ratelimit:global"], [RESERVE[priority]]
+        args += [self.rate, self.burst]
+        if token is not None:
+            keys.append(bucket_key(token))
+            args += [self.token_rate, self.token_burst]
+        deadline = time.monotonic() + timeout
+        self.waiting[priority] += 1
+        try:
+            while True:
+                if any(self.waiting[p] for p in range(priority)):
+                    wait = 0.05
+                else:
+                    try:
+                        wait = await self.take(keys=keys, args=args) / 1000
+                    except aioredis.RedisError as e:
+                        print(f"Rate limiter unavailable: {e}")
+                        return True
+                    if wait <= 0:
+                        return True
+                if time.monotonic() + wait > deadline:
+                    return False
+                await asyncio.sleep(wait)
+        finally:
+            self.waiting[priority] -= 1
+
+    async def block(self, retry_after: float) -> None:
+        """Stop all requests for retry_after seconds after a 429."""
+        try:
+            await self.redis.set(BLOCKED_KEY, 1, px=int(retry_after * 1000))
+        except aioredis.RedisError as e:
+            print(f"Rate limiter unavailable: {e}")
@@ -0,0 +1,103 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+from board import board_key, render_board, render_replay, replay_key
+from cache import RenderCache
+from renderer import get_renderer
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", 32))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", 60))
+
+
+class RenderService:
+    """
+    Runs CPU-bound rendering jobs in a process pool off the event loop.
+
+    Board and replay renders go through a RenderCache first.
+
+    At most queue_size jobs are handed to the pool at once, counting jobs
+    still running after their caller timed out. Further callers wait for a
+    free slot.
+    """
+
+    def __init__(
+        self,
+        workers: int = RENDER_WORKERS,
+        queue_size: int = RENDER_QUEUE_SIZE,
+        timeout: float = RENDER_TIMEOUT,
+    ):
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(max(queue_size, workers))
+        self.pool = None
+        self.cache = RenderCache()
+
+    def start(self) -> None:
+        self.pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=get_renderer,
+        )
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    async def submit(
+        self,
+        fn: Callable,
+        *args: Any,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """
+        Run fn(*args) in a worker process.
+
+        Args:
+        - fn: picklable module level function.
+        - args: picklable arguments.
+        - timeout: seconds to wait for the result, defaults to RENDER_TIMEOUT.
+
+        Returns:
+        - the return value of fn.
+        """
+        await self.slots.acquire()
+        try:
+            if self.pool is None:
+                self.start()
+            future = asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+        except BaseException as e:
+            self.slots.release()
+            if isinstance(e, BrokenProcessPool):
+                self.close()
+            raise
+        # The slot is held until the worker process is done, not until the
+        # caller stops waiting, so timed out renders still count as load.
+        future.add_done_callback(self.release)
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(future), timeout or self.timeout
+            )
+        except BrokenProcessPool:
+            self.close()
+            raise
+
+    def release(self, future: asyncio.Future) -> None:
+        self.slots.release()
+        if not future.cancelled():
+            future.exception()
+
+    async def render_board(self, board_fen: str) -> bytes:
+        return await self.cache.get_or_render(
+            board_key(board_fen), lambda: self.submit(render_board, board_fen)
+        )
+
+    async def render_replay(self, moves: str) -> bytes:
+        return await self.cache.get_or_render(
+            replay_key(moves), lambda: self.submit(render_replay, moves)
+        )
@@ -0,0 +1,271 @@
+import os
+from dataclasses import astuple
+from functools import cached_property, lru_cache
+from io import BytesIO
+from typing import Optional, Union
+
+import chess
+from PIL import Image, ImageDraw, ImageFont
+
+from models.render import Theme
+
+BOARD_RENDERER = os.getenv("BOARD_RENDERER", "atlas")
+BOARD_SQUARE_SIZE = int(os.getenv("BOARD_SQUARE_SIZE", 60))
+BOARD_FONT = os.getenv("BOARD_FONT", "DejaVuSans.ttf")
+
+
+def load_font(size: int) -> ImageFont.FreeTypeFont:
+    """
+    Load a font that has the unicode chess glyphs.
+
+    Args:
+    - size: font size in pixels.
+
+    Returns:
+    - the configured font, matplotlib's bundled DejaVu Sans or PIL's default.
+    """
+    try:
+        return ImageFont.truetype(BOARD_FONT, size)
+    except OSError:
+        pass
+    try:
+        import matplotlib
+
+        return ImageFont.truetype(
+            os.path.join(matplotlib.get_data_path(), "fonts", "ttf", "DejaVuSans.ttf"),
+            size,
+        )
+    except (ImportError, OSError):
+        return ImageFont.load_default(size)
+
+
+class SpriteAtlas:
+    """
+    Square and piece tiles pre-rendered once per theme and square size.
+
+    Boards are composited by pasting tiles onto a cached base image that
+    already holds the empty squares and the coordinates.
+    """
+
+    def __init__(self, theme: Theme, square_size: int):
+        self.theme = theme
+        self.square_size = square_size
+        self.margin = square_size // 2
+        self.size = 8 * square_size + 2 * self.margin
+        piece_font = load_font(int(square_size * 0.8))
+        label_font = load_font(max(square_size // 4, 8))
+        self.tiles = {}
+        for light in (True, False):
+            color = theme.light if light else theme.dark
+            for symbol in chess.UNICODE_PIECE_SYMBOLS:
+                tile = Image.new("RGB", (square_size, square_size), color)
+                ImageDraw.Draw(tile).text(
+                    (square_size / 2, square_size / 2),
+                    chess.UNICODE_PIECE_SYMBOLS[symbol],
+                    fill=theme.text,
+                    font=piece_font,
+                    anchor="mm",
+                )
+                self.tiles[light, symbol] = tile
+        self.base = Image.new("RGB", (self.size, self.size), theme.background)
+        draw = ImageDraw.Draw(self.base)
+        for square in chess.SQUARES:
+            x, y = self.origin(square)
+            draw.rectangle(
+                (x, y, x + square_size - 1, y + square_size - 1),
+                fill=theme.light if self.is_light(square) else theme.dark,
+            )
+        for i in range(8):
+            draw.text(
+                (self.margin + (i + 0.5) * square_size, self.size - self.margin / 2),
+                chess.FILE_NAMES[i],
+                fill=theme.text,
+                font=label_font,
+                anchor="mm",
+            )
+            draw.text(
+                (self.margin / 2, self.margin + (7 - i + 0.5) * square_size),
+                chess.RANK_NAMES[i],
+                fill=theme.text,
+                font=label_font,
+                anchor="mm",
+            )
+
+    @staticmethod
+    def is_light(square: chess.Square) -> bool:
+        return (chess.square_file(square) + chess.square_rank(square)) % 2 == 1
+
+    def origin(self, square: chess.Square) -> tuple[int, int]:
+        return (
+            self.margin + chess.square_file(square) * self.square_size,
+            self.margin + (7 - chess.square_rank(square)) * self.square_size,
+        )
+
+    @cached_property
+    def indexed(self) -> tuple[Image.Image, dict]:
+        """Base image and tiles quantized once to a single shared palette."""
+        tiles = list(self.tiles.items())
+        sample = Image.new(
+            "RGB", (self.size, self.size + len(tiles) * self.square_size)
+        )
+        sample.paste(self.base, (0, 0))
+        for i, (_, tile) in enumerate(tiles):
+            sample.paste(tile, (0, self.size + i * self.square_size))
+        palette = sample.quantize(colors=256, dither=Image.Dither.NONE)
+        return palette.crop((0, 0, self.size, self.size)), {
+            key: tile.quantize(palette=palette, dither=Image.Dither.NONE)
+            for key, tile in tiles
+        }
+
+    def render(self, board: chess.Board, indexed: bool = False) -> Image.Image:
+        base, tiles = self.indexed if indexed else (self.base, self.tiles)
+        image = base.copy()
+        for square, piece in board.piece_map().items():
+            image.paste(
+                tiles[self.is_light(square), piece.symbol()], self.origin(square)
+            )
+        return image
+
+    def changed_box(
+        self,
+        before: dict[chess.Square, chess.Piece],
+        after: dict[chess.Square, chess.Piece],
+    ) -> Optional[tuple[int, int, int, int]]:
+        """
+        Bounding box of the squares whose piece differs between two piece maps.
+        """
+        changed = [
+            square
+            for square in before.keys() | after.keys()
+            if before.get(square) != after.get(square)
+        ]
+        if not changed:
+            return None
+        origins = [self.origin(square) for square in changed]
+        return (
+            min(x for x, _ in origins),
+            min(y for _, y in origins),
+            max(x for x, _ in origins) + self.square_size,
+            max(y for _, y in origins) + self.square_size,
+        )
+
+
+class AtlasRenderer:
+    def __init__(self, theme: Theme, square_size: int):
+        self.atlas = SpriteAtlas(theme, square_size)
+
+    @property
+    def palette(self) -> Image.Image:
+        return self.atlas.indexed[0]
+
+    def render(self, board: chess.Board) -> Image.Image:
+        return self.atlas.render(board)
+
+    def render_frame(self, board: chess.Board) -> Image.Image:
+        return self.atlas.render(board, indexed=True)
+
+    def changed_box(
+        self,
+        before: dict[chess.Square, chess.Piece],
+        after: dict[chess.Square, chess.Piece],
+    ) -> Optional[tuple[int, int, int, int]]:
+        return self.atlas.changed_box(before, after)
+
+    def render_png(self, board: chess.Board) -> bytes:
+        buf = BytesIO()
+        self.render(board).save(buf, format="PNG", compress_level=1)
+        return buf.getvalue()
+
+
+class MatplotlibRenderer:
+    """Original matplotlib drawing, kept as a fallback backend."""
+
+    def __init__(self, theme: Theme, square_size: int):
+        self.theme = theme
+
+    def render_png(self, board: chess.Board) -> bytes:
+        import matplotlib
+
+        matplotlib.use("Agg")
+        import matplotlib.patches as patches
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots()
+        ax.set_xlim([0, 8])
+        ax.set_ylim([0, 8])
+        ax.set_aspect("equal")
+        ax.set_axis_off()
+        for i in range(8):
+            for j in range(8):
+                if (i + j) % 2 == 0:
+                    color = self.theme.dark
+                else:
+                    color = self.theme.light
+                ax.add_patch(patches.Rectangle((i, j), 1, 1, color=color))
+        for i in range(8):
+            for j in range(8):
+                piece = board.piece_at(chess.square(i, j))
+                if piece is not None:
+                    ax.text(
+                        i + 0.5,
+                        j + 0.5,
+                        chess.UNICODE_PIECE_SYMBOLS[piece.symbol()],
+                        fontsize=30,
+                        ha="center",
+                        va="center",
+                    )
+            ax.text(i + 0.5, -0.5, chess.FILE_NAMES[i], ha="center", va="center")
+            ax.text(
+                -0.5,
+                i + 0.5,
+                chess.RANK_NAMES[i],
+                ha="center",
+            )
+        buf = BytesIO()
+        fig.savefig(buf, format="png")
+        plt.close(fig)
+        return buf.getvalue()
+
+    def render(self, board: chess.Board) -> Image.Image:
+        return Image.open(BytesIO(self.render_png(board))).convert("RGB")
+
+    @cached_property
+    def palette(self) -> Image.Image:
+        return self.render(chess.Board()).quantize(colors=256, dither=Image.Dither.NONE)
+
+    def render_frame(self, board: chess.Board) -> Image.Image:
+        return self.render(board).quantize(
+            palette=self.palette, dither=Image.Dither.NONE
+        )
+
+    def changed_box(
+        self,
+        before: dict[chess.Square, chess.Piece],
+        after: dict[chess.Square, chess.Piece],
+    ) -> None:
+        return None
+
+
+RENDERERS = {"atlas": AtlasRenderer, "matplotlib": MatplotlibRenderer}
+
+
+def render_key(theme: Theme = Theme(), square_size: int = BOARD_SQUARE_SIZE) -> str:
+    """Identify the renderer output for cache keys."""
+    return ":".join([BOARD_RENDERER, str(square_size), *astuple(theme)])
+
+
+@lru_cache(maxsize=None)
+def get_renderer(
+    theme: Theme = Theme(), square_size: int = BOARD_SQUARE_SIZE
+) -> Union[AtlasRenderer, MatplotlibRenderer]:
+    """
+    Get the board renderer for a theme and size, building it on first use.
+
+    Args:
+    - theme: colors of the board.
+    - square_size: width of a square in pixels.
+
+    Returns:
+    - the renderer selected by BOARD_RENDERER.
+    """
+    return RENDERERS.get(BOARD_RENDERER, AtlasRenderer)(theme, square_size)
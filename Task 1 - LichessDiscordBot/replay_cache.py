@@ -0,0 +1,102 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import re
+from typing import Optional
+
+from board import replay_options
+
+REPLAY_CACHE_DIR = os.getenv(
+    "REPLAY_CACHE_DIR", os.path.join(os.path.dirname(__file__), ".replay_cache")
+)
+REPLAY_CACHE_BYTES = int(os.getenv("REPLAY_CACHE_BYTES", 256 * 1024 * 1024))
+
+GAME_ID = re.compile(r"^[A-Za-z0-9]{8,12}$")
+UNFINISHED = {"created", "started"}
+
+
+class ReplayCache:
+    """
+    On-disk cache of exported finished games and their encoded replays.
+
+    Finished games never change, so entries are only evicted, least recently
+    used first, once the directory grows past max_bytes.
+    """
+
+    def __init__(
+        self, directory: str = REPLAY_CACHE_DIR, max_bytes: int = REPLAY_CACHE_BYTES
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def is_finished(game: dict) -> bool:
+        return game.get("status") not in UNFINISHED
+
+    def game_path(self, game_id: str) -> str:
+        return os.path.join(self.directory, f"{game_id}.json")
+
+    def replay_path(self, game_id: str) -> str:
+        options = hashlib.sha1(replay_options().encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.directory, f"{game_id}.{options}.gif")
+
+    def read(self, path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return None
+        # Another process may evict the file once it is read, the data is
+        # still good then.
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+        return data
+
+    def write(self, path: str, data: bytes) -> None:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as file:
+            file.write(data)
+        os.replace(tmp, path)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    async def get_game(self, game_id: str) -> Optional[dict]:
+        if not GAME_ID.match(game_id):
+            return None
+        data = await asyncio.to_thread(self.read, self.game_path(game_id))
+        return json.loads(data) if data is not None else None
+
+    async def set_game(self, game_id: str, game: dict) -> None:
+        if not GAME_ID.match(game_id) or not self.is_finished(game):
+            return
+        data = json.dumps(game, default=str).encode("utf-8")
+        await asyncio.to_thread(self.write, self.game_path(game_id), data)
+
+    async def get_replay(self, game_id: str) -> Optional[bytes]:
+        if not GAME_ID.match(game_id):
+            return None
+        return await asyncio.to_thread(self.read, self.replay_path(game_id))
+
+    async def set_replay(self, game_id: str, game: dict, gif: bytes) -> None:
+        if not GAME_ID.match(game_id) or not self.is_finished(game):
+            return
+        await asyncio.to_thread(self.write, self.replay_path(game_id), gif)
@@ -1,81 +1,135 @@
+import asyncio
+import base64
+import contextlib
+import hashlib
 import os
-from flask import Flask, jsonify, request
-from flask import url_for
+import secrets
+from urllib.parse import urlencode
+
+import aiohttp
+import uvicorn
 from dotenv import load_dotenv
-import requests
-from authlib.integrations.flask_client import OAuth
-import redis
-import json
-from models.data import Auth
-from dataclasses import asdict
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, RedirectResponse
+from starlette.routing import Route
 
 load_dotenv()
 
-LICHESS_HOST = os.getenv("LICHESS_HOST", "https://lichess.org")
-r = redis.Redis(host="localhost", port=6379, db=0)
-
-app = Flask(__name__)
-app.secret_key = os.urandom(24)
-
-oauth = OAuth(app)
-oauth.register(
-    name="lichess",
-    client_id=os.getenv("LICHESS_CLIENT_ID"),
-    client_secret=os.getenv("LICHESS_CLIENT_SECRET"),
-    authorize_url=f"{LICHESS_HOST}/oauth",
-    access_token_url=f"{LICHESS_HOST}/api/token",
-    client_kwargs={
-        "code_challenge_method": "S256",
-        "token_endpoint_auth_method": "client_secret_post",
-    },
-)
+import store
+from lichess import LICHESS_HOST, LichessClient, LichessError
+from models.data import Auth, Login
+
+LICHESS_CLIENT_ID = os.getenv("LICHESS_CLIENT_ID")
+LICHESS_CLIENT_SECRET = os.getenv("LICHESS_CLIENT_SECRET")
+SERVER_HOST = os.getenv("SERVER_HOST", "localhost")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 5000))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 4))
+SCOPES = [
+    "challenge:read",
+    "challenge:write",
+    "email:read",
+    "tournament:write",
+    "board:play",
+]
+
+lichess = LichessClient()
+
 
-session = {}
-
-
-@app.route("/login/<discord_user_id>")
-def login(discord_user_id):
-    session["discord_user_id"] = discord_user_id
-    redirect_uri = url_for("authorize", _external=True)
-    return oauth.lichess.authorize_redirect(
-        redirect_uri,
-        scope=" ".join(
-            [
-                "challenge:read",
-                "challenge:write",
-                "email:read",
-                "tournament:write",
-                "board:play",
-            ]
+def code_challenge(code_verifier: str) -> str:
+    digest = hashlib.sha256(code_verifier.encode("ascii")).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii")
+
+
+async def login(request: Request) -> RedirectResponse:
+    """
+    Start the Lichess OAuth flow of a Discord user.
+
+    The Discord id and the PKCE verifier are stored in Redis under a random
+    state that Lichess hands back to the callback, so concurrent logins never
+    share server state.
+    """
+    state = secrets.token_urlsafe(32)
+    code_verifier = secrets.token_urlsafe(64)
+    await store.set_login(
+        state,
+        Login(
+            discord_id=int(request.path_params["discord_user_id"]),
+            code_verifier=code_verifier,
         ),
     )
+    query = urlencode(
+        {
+            "response_type": "code",
+            "client_id": LICHESS_CLIENT_ID,
+            "redirect_uri": str(request.url_for("authorize")),
+            "scope": " ".join(SCOPES),
+            "code_challenge_method": "S256",
+            "code_challenge": code_challenge(code_verifier),
+            "state": state,
+        }
+    )
+    return RedirectResponse(f"{LICHESS_HOST}/oauth?{query}")
 
 
-@app.route("/authorize")
-def authorize():
-    discord_user_id = session.get("discord_user_id", None)
-    if discord_user_id is None:
-        return jsonify({"error": "discord_user_id is required"}), 400
+async def authorize(request: Request) -> JSONResponse:
+    state = request.query_params.get("state")
+    code = request.query_params.get("code")
+    pending = await store.pop_login(state) if state else None
+    if pending is None:
+        return JSONResponse({"error": "unknown or expired login"}, status_code=400)
+    if code is None:
+        error = request.query_params.get("error", "code is required")
+        return JSONResponse({"error": error}, status_code=400)
     try:
-        token = oauth.lichess.authorize_access_token()
-        bearer = token["access_token"]
-        headers = {"Authorization": f"Bearer {bearer}"}
-        response = requests.get(f"{LICHESS_HOST}/api/account", headers=headers)
-        response.raise_for_status()
-        auth = Auth(
-            discord_id=discord_user_id,
-            token=bearer,
-            lichess_username=response.json()["username"],
+        token = await lichess.exchange_code(
+            code,
+            pending.code_verifier,
+            str(request.url_for("authorize")),
+            LICHESS_CLIENT_ID,
+            LICHESS_CLIENT_SECRET,
         )
-        r.set(
-            f"auth_{discord_user_id}",
-            json.dumps(asdict(auth)),
-            ex=7200,
+        account = await lichess.get_account(token["access_token"])
+        await store.set_auth(
+            Auth(
+                discord_id=pending.discord_id,
+                token=token["access_token"],
+                lichess_username=account["username"],
+            )
         )
-        return jsonify(response.json())
-    except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return JSONResponse(account)
+    except LichessError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return JSONResponse(
+            {"error": f"could not reach Lichess: {e!r}"}, status_code=502
+        )
+    except KeyError as e:
+        # A token or account response without the expected fields.
+        return JSONResponse(
+            {"error": f"unexpected response from Lichess: missing {e}"},
+            status_code=502,
+        )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette):
+    await lichess.start()
+    yield
+    await lichess.close()
+    await store.close()
+
+
+app = Starlette(
+    routes=[
+        Route("/login/{discord_user_id:int}", login, name="login"),
+        Route("/authorize", authorize, name="authorize"),
+    ],
+    lifespan=lifespan,
+)
 
 
 if __name__ == "__main__":
-    app.run(host="localhost", port=5000)
+    uvicorn.run(
+        "server:app", host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS
+    )
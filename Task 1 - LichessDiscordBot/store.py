@@ -0,0 +1,290 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Optional
+
+import redis.asyncio as aioredis
+
+from models.data import Auth, Challenge, Login, StreamRecord
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 32))
+AUTH_TTL = 7200
+LOGIN_TTL = 600
+CHALLENGE_TTL = int(os.getenv("CHALLENGE_TTL", 1200))
+STREAMS_KEY = "streams"
+AUTH_CHANNEL = "auth_invalidate"
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", 300))
+
+pool = aioredis.ConnectionPool.from_url(
+    REDIS_URL, max_connections=REDIS_MAX_CONNECTIONS
+)
+r = aioredis.Redis(connection_pool=pool)
+
+
+# Sets the current game of every user that is still logged in, leaving the
+# hashes of logged out users absent so they keep no state without a TTL.
+SET_GAME = r.register_script("""
+    for _, key in ipairs(KEYS) do
+        if redis.call("EXISTS", key) == 1 then
+            redis.call("HSET", key, "game_id", ARGV[1])
+        end
+    end
+    """)
+RENEW_LEASE = r.register_script("""
+    if redis.call("GET", KEYS[1]) == ARGV[1] then
+        return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+    end
+    return 0
+    """)
+RELEASE_LEASE = r.register_script("""
+    if redis.call("GET", KEYS[1]) == ARGV[1] then
+        return redis.call("DEL", KEYS[1])
+    end
+    return 0
+    """)
+
+
+class AuthCache:
+    """
+    Bounded in-process cache of decoded Auth records.
+
+    An entry lives until ttl or the expiry of its user hash, whichever comes
+    first. Entries are only served while watch_auth is subscribed to the
+    invalidations published on every login.
+    """
+
+    def __init__(self, max_entries: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.version = 0
+        self.live = False
+
+    def get(self, user_id: int) -> Optional[Auth]:
+        if not self.live:
+            return None
+        entry = self.items.get(user_id)
+        if entry is None:
+            return None
+        auth, expires = entry
+        if expires <= time.monotonic():
+            del self.items[user_id]
+            return None
+        self.items.move_to_end(user_id)
+        return auth
+
+    def set(self, auth: Auth, ttl: float, version: int) -> None:
+        """
+        Cache an auth record read from Redis.
+
+        Args:
+        - auth: the decoded record.
+        - ttl: seconds until the user hash expires.
+        - version: value of self.version before the record was read, the
+          record is dropped if an invalidation arrived in between.
+        """
+        if not self.live or version != self.version:
+            return
+        self.items[auth.discord_id] = (auth, time.monotonic() + min(ttl, self.ttl))
+        self.items.move_to_end(auth.discord_id)
+        while len(self.items) > self.max_entries:
+            self.items.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self.version += 1
+        self.items.pop(user_id, None)
+
+    def clear(self) -> None:
+        self.version += 1
+        self.items.clear()
+
+
+auth_cache = AuthCache()
+
+
+def user_key(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def challenge_key(message_id: int) -> str:
+    return f"challenge:{message_id}"
+
+
+def lease_key(game_id: str) -> str:
+    return f"lease:stream:{game_id}"
+
+
+def login_key(state: str) -> str:
+    return f"login:{state}"
+
+
+def auth_fields(auth: Auth) -> dict:
+    return {"token": auth.token, "lichess_username": auth.lichess_username}
+
+
+async def get_auth(user_id: int) -> Optional[Auth]:
+    auth = auth_cache.get(user_id)
+    if auth is not None:
+        return auth
+    version = auth_cache.version
+    async with r.pipeline(transaction=False) as pipe:
+        pipe.hmget(user_key(user_id), "token", "lichess_username")
+        pipe.pttl(user_key(user_id))
+        (token, username), ttl = await pipe.execute()
+    if token is None:
+        return None
+    auth = Auth(
+        discord_id=user_id,
+        token=token.decode("utf-8"),
+        lichess_username=username.decode("utf-8"),
+    )
+    if ttl > 0:
+        auth_cache.set(auth, ttl / 1000, version)
+    return auth
+
+
+async def set_auth(auth: Auth) -> None:
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(user_key(auth.discord_id), mapping=auth_fields(auth))
+        pipe.expire(user_key(auth.discord_id), AUTH_TTL)
+        pipe.publish(AUTH_CHANNEL, auth.discord_id)
+        await pipe.execute()
+
+
+async def watch_auth() -> None:
+    """
+    Evict cached auth records as logins are published on AUTH_CHANNEL.
+
+    The cache is cleared and bypassed whenever the subscription is down, so
+    a missed invalidation never serves a stale token.
+    """
+    delay = 1
+    while True:
+        pubsub = r.pubsub()
+        try:
+            await pubsub.subscribe(AUTH_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "subscribe":
+                    auth_cache.live = True
+                    delay = 1
+                elif message["type"] == "message":
+                    auth_cache.invalidate(int(message["data"]))
+        except aioredis.RedisError as e:
+            print(f"Auth invalidation feed dropped: {e}")
+        finally:
+            auth_cache.live = False
+            auth_cache.clear()
+            await pubsub.aclose()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60)
+
+
+async def set_login(state: str, login: Login) -> None:
+    await r.set(login_key(state), json.dumps(asdict(login)), ex=LOGIN_TTL)
+
+
+async def pop_login(state: str) -> Optional[Login]:
+    """Take the pending login of an OAuth state, each state can be used once."""
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.get(login_key(state))
+        pipe.delete(login_key(state))
+        data, _ = await pipe.execute()
+    if data is None:
+        return None
+    return Login(**json.loads(data.decode("utf-8")))
+
+
+async def get_game(user_id: int) -> Optional[str]:
+    game_id = await r.hget(user_key(user_id), "game_id")
+    return game_id.decode("utf-8") if game_id is not None else None
+
+
+async def set_game(game_id: str, *user_ids: int) -> None:
+    """
+    Atomically make a game the current game of one or more logged in users.
+
+    Args:
+    - game_id: Lichess game id.
+    - user_ids: Discord ids of the players.
+    """
+    await SET_GAME(keys=[user_key(user_id) for user_id in user_ids], args=[game_id])
+
+
+async def get_challenge(message_id: int) -> Optional[Challenge]:
+    data = await r.hgetall(challenge_key(message_id))
+    if not data:
+        return None
+    data = {key.decode("utf-8"): value.decode("utf-8") for key, value in data.items()}
+    return Challenge(
+        challenge_id=data["challenge_id"],
+        message_id=int(data["message_id"]),
+        user_id=int(data["user_id"]),
+        opponent_id=int(data["opponent_id"]),
+    )
+
+
+async def set_challenge(challenge: Challenge) -> None:
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(challenge_key(challenge.message_id), mapping=asdict(challenge))
+        pipe.expire(challenge_key(challenge.message_id), CHALLENGE_TTL)
+        await pipe.execute()
+
+
+async def delete_challenge(message_id: int) -> None:
+    await r.delete(challenge_key(message_id))
+
+
+async def add_stream(record: StreamRecord) -> None:
+    await r.hset(
+        STREAMS_KEY,
+        f"{record.game_id}:{record.message_id}",
+        json.dumps(asdict(record)),
+    )
+
+
+async def remove_stream(game_id: str, message_id: int) -> None:
+    await r.hdel(STREAMS_KEY, f"{game_id}:{message_id}")
+
+
+async def get_streams() -> list[StreamRecord]:
+    records = await r.hvals(STREAMS_KEY)
+    return [StreamRecord(**json.loads(data.decode("utf-8"))) for data in records]
+
+
+async def claim_lease(game_id: str, owner: str, ttl: float) -> bool:
+    """
+    Take the lease on streaming a game if no live process holds it.
+
+    Args:
+    - game_id: Lichess game id.
+    - owner: id of the claiming process.
+    - ttl: seconds until the lease expires unless renewed.
+
+    Returns:
+    - whether the lease was taken.
+    """
+    return bool(await r.set(lease_key(game_id), owner, nx=True, px=int(ttl * 1000)))
+
+
+async def renew_lease(game_id: str, owner: str, ttl: float) -> bool:
+    return bool(
+        await RENEW_LEASE(keys=[lease_key(game_id)], args=[owner, int(ttl * 1000)])
+    )
+
+
+async def release_lease(game_id: str, owner: str) -> None:
+    await RELEASE_LEASE(keys=[lease_key(game_id)], args=[owner])
+
+
+async def get_lease(game_id: str) -> Optional[str]:
+    owner = await r.get(lease_key(game_id))
+    return owner.decode("utf-8") if owner is not None else None
+
+
+async def close() -> None:
+    await pool.disconnect()
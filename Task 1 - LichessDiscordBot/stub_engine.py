@@ -0,0 +1,74 @@
+"""
+Minimal UCI engine for running the bot without Stockfish, e.g. in tests.
+
+It answers every search instantly with the material balance and the first
+legal capture or move, set ENGINE_PATH="python3 stub_engine.py" to use it.
+"""
+
+import sys
+
+import chess
+
+VALUES = {
+    chess.PAWN: 100,
+    chess.KNIGHT: 300,
+    chess.BISHOP: 300,
+    chess.ROOK: 500,
+    chess.QUEEN: 900,
+}
+
+
+def material(board: chess.Board) -> int:
+    score = 0
+    for piece in board.piece_map().values():
+        value = VALUES.get(piece.piece_type, 0)
+        score += value if piece.color == board.turn else -value
+    return score
+
+
+def position(board: chess.Board, args: list[str]) -> chess.Board:
+    if args[0] == "startpos":
+        board = chess.Board(chess960=board.chess960)
+        args = args[1:]
+    else:
+        board = chess.Board(" ".join(args[1:7]), chess960=board.chess960)
+        args = args[7:]
+    for move in args[1:] if args and args[0] == "moves" else []:
+        board.push_uci(move)
+    return board
+
+
+def main() -> None:
+    board = chess.Board()
+    for line in sys.stdin:
+        command, *args = line.split()
+        if command == "uci":
+            print("id name Stub")
+            print("option name UCI_Chess960 type check default false")
+            print("uciok")
+        elif command == "isready":
+            print("readyok")
+        elif command == "setoption" and args[1] == "UCI_Chess960":
+            board.chess960 = args[-1] == "true"
+        elif command == "position":
+            board = position(board, args)
+        elif command == "go":
+            depth = int(args[args.index("depth") + 1]) if "depth" in args else 1
+            moves = sorted(
+                board.legal_moves, key=lambda move: not board.is_capture(move)
+            )
+            if moves:
+                print(
+                    f"info depth {depth} score cp {material(board)} pv {moves[0].uci()}"
+                )
+                print(f"bestmove {moves[0].uci()}")
+            else:
+                print(f"info depth 0 score {'mate 0' if board.is_check() else 'cp 0'}")
+                print("bestmove (none)")
+        elif command == "quit":
+            return
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import socket
+import uuid
+from typing import Coroutine
+
+import discord
+from discord.ext import commands
+
+import store
+from engine import EnginePool
+from hub import STREAM_BOARD_MODE, StreamHub
+from lichess import LichessClient
+from models.data import StreamRecord
+from render_service import RenderService
+
+STREAM_MAX_ACTIVE = int(os.getenv("STREAM_MAX_ACTIVE", 50))
+STREAM_LEASE_TTL = float(os.getenv("STREAM_LEASE_TTL", 15))
+
+
+class StreamLimitReached(Exception):
+    pass
+
+
+class StreamSupervisor:
+    """
+    Owns every background task of the bot and the StreamHub.
+
+    Stream messages are persisted in Redis, and the process streaming a game
+    holds a lease on it that it renews every third of STREAM_LEASE_TTL. Every
+    bot process syncs with Redis on that period: it claims games nobody
+    holds (new streams, a restart or a crashed process), attaches messages
+    added by other processes and drops the ones removed elsewhere. At most
+    max_active games are streamed by one process.
+    """
+
+    def __init__(
+        self,
+        bot: commands.Bot,
+        lichess: LichessClient,
+        render_service: RenderService,
+        engines: EnginePool,
+        max_active: int = STREAM_MAX_ACTIVE,
+        lease_ttl: float = STREAM_LEASE_TTL,
+    ):
+        self.bot = bot
+        self.max_active = max_active
+        self.lease_ttl = lease_ttl
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.hub = StreamHub(
+            lichess,
+            render_service,
+            engines,
+            on_leave=self.forget,
+            on_finish=self.finish,
+        )
+        self.owned = set()
+        self.lock = asyncio.Lock()
+        self.tasks = set()
+        self.maintaining = False
+
+    def spawn(self, coro: Coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.done)
+        return task
+
+    def done(self, task: asyncio.Task) -> None:
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Background task failed: {task.exception()!r}")
+
+    def forget(self, game_id: str, message: discord.Message) -> None:
+        self.spawn(self.leave(game_id, message.id))
+
+    async def leave(self, game_id: str, message_id: int) -> None:
+        async with self.lock:
+            await store.remove_stream(game_id, message_id)
+            if game_id in self.owned and game_id not in self.hub.streams:
+                self.owned.discard(game_id)
+                await store.release_lease(game_id, self.worker_id)
+
+    async def finish(self, game_id: str, message_ids: list[int]) -> None:
+        """
+        Remove the records of a finished game before the hub drops its
+        stream, the lease is released on the next sync.
+        """
+        async with self.lock:
+            for message_id in message_ids:
+                await store.remove_stream(game_id, message_id)
+
+    async def claim(self, game_id: str) -> bool:
+        if game_id in self.owned:
+            return True
+        if len(self.owned) >= self.max_active:
+            return False
+        if await store.claim_lease(game_id, self.worker_id, self.lease_ttl):
+            self.owned.add(game_id)
+            return True
+        return False
+
+    async def attach(self, record: StreamRecord) -> None:
+        auth = await store.get_auth(record.user_id)
+        if auth is None:
+            await store.remove_stream(record.game_id, record.message_id)
+            return
+        message = self.bot.get_partial_messageable(
+            record.channel_id
+        ).get_partial_message(record.message_id)
+        await self.hub.subscribe(
+            record.game_id,
+            auth.token,
+            message,
+            eval_bar=record.eval_bar,
+            mode=record.mode,
+        )
+
+    async def start_stream(
+        self,
+        game_id: str,
+        user_id: int,
+        token: str,
+        destination: discord.abc.Messageable,
+        eval_bar: bool = False,
+        mode: str = STREAM_BOARD_MODE,
+    ) -> None:
+        """
+        Post a board message and stream a game into it.
+
+        The game is streamed here if this process holds or can take its
+        lease, otherwise the owning process attaches the message on its next
+        sync.
+
+        Args:
+        - game_id: Lichess game id.
+        - user_id: Discord id of the user whose token opens the stream.
+        - token: Lichess token of that user.
+        - destination: context or channel the board is posted in.
+        - eval_bar: show a live engine evaluation under the board.
+        - mode: "image" or "text", how the board is shown.
+        """
+        if (
+            game_id not in self.owned
+            and len(self.owned) >= self.max_active
+            and await store.get_lease(game_id) is None
+        ):
+            raise StreamLimitReached()
+        # Sent outside the lock so a slow Discord call does not hold up the
+        # sync loop, claim still enforces the limit and a game this process
+        # cannot take is picked up by another one on its next sync.
+        message = await destination.send(embed=discord.Embed(title="Game in progress"))
+        async with self.lock:
+            await store.add_stream(
+                StreamRecord(
+                    game_id=game_id,
+                    channel_id=message.channel.id,
+                    message_id=message.id,
+                    user_id=user_id,
+                    eval_bar=eval_bar,
+                    mode=mode,
+                )
+            )
+            if await self.claim(game_id):
+                await self.hub.subscribe(
+                    game_id, token, message, eval_bar=eval_bar, mode=mode
+                )
+
+    async def stop_stream(self, game_id: str, channel_id: int) -> int:
+        """
+        Stop streaming a game in a channel, whichever process streams it.
+
+        Returns:
+        - the number of stream messages removed.
+        """
+        removed = 0
+        for record in await store.get_streams():
+            if record.game_id == game_id and record.channel_id == channel_id:
+                await store.remove_stream(game_id, record.message_id)
+                removed += 1
+        return max(removed, self.hub.unsubscribe_channel(game_id, channel_id))
+
+    async def sync(self) -> None:
+        """Renew held leases and reconcile the local streams with Redis."""
+        for game_id in list(self.owned):
+            if not await store.renew_lease(game_id, self.worker_id, self.lease_ttl):
+                self.owned.discard(game_id)
+                self.hub.drop(game_id)
+        records = {}
+        for record in await store.get_streams():
+            records.setdefault(record.game_id, {})[record.message_id] = record
+        for game_id, messages in records.items():
+            if not await self.claim(game_id):
+                continue
+            stream = self.hub.streams.get(game_id)
+            for message_id, record in messages.items():
+                if stream is None or message_id not in stream.editors:
+                    await self.attach(record)
+                    stream = self.hub.streams.get(game_id)
+        for game_id in list(self.owned):
+            stream = self.hub.streams.get(game_id)
+            if stream is None:
+                if game_id not in records:
+                    self.owned.discard(game_id)
+                    await store.release_lease(game_id, self.worker_id)
+                continue
+            for message_id, editor in list(stream.editors.items()):
+                if message_id not in records.get(game_id, {}):
+                    self.hub.unsubscribe(game_id, editor.message)
+
+    async def maintain(self) -> None:
+        while True:
+            try:
+                async with self.lock:
+                    await self.sync()
+            except Exception as e:
+                print(f"Stream sync failed: {e!r}")
+            await asyncio.sleep(self.lease_ttl / 3)
+
+    def start(self) -> None:
+        """Start syncing streams with Redis, once the bot is connected."""
+        if self.maintaining:
+            return
+        self.maintaining = True
+        self.spawn(self.maintain())
+
+    async def close(self) -> None:
+        self.hub.close()
+        for task in list(self.tasks):
+            task.cancel()
+        for game_id in list(self.owned):
+            await store.release_lease(game_id, self.worker_id)
+        self.owned.clear()
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from cache import RenderCache
+
+
+def test_concurrent_misses_share_one_render():
+    async def main():
+        cache = RenderCache()
+        calls = []
+
+        async def render():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return b"png"
+
+        values = await asyncio.gather(
+            *[cache.get_or_render("key", render) for _ in range(5)]
+        )
+        assert values == [b"png"] * 5
+        assert len(calls) == 1
+        assert await cache.get_or_render("key", render) == b"png"
+        assert len(calls) == 1
+        assert not cache.inflight
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_other_waiters():
+    async def main():
+        cache = RenderCache()
+
+        async def render():
+            await asyncio.sleep(0.05)
+            return b"png"
+
+        first = asyncio.create_task(cache.get_or_render("key", render))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(cache.get_or_render("key", render))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == b"png"
+        assert first.cancelled()
+
+    asyncio.run(main())
+
+
+def test_failed_render_is_not_cached():
+    async def main():
+        cache = RenderCache()
+
+        async def fail():
+            raise RuntimeError("render failed")
+
+        async def render():
+            return b"png"
+
+        with pytest.raises(RuntimeError):
+            await cache.get_or_render("key", fail)
+        assert await cache.get_or_render("key", render) == b"png"
+
+    asyncio.run(main())
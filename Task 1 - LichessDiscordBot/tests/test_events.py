@@ -0,0 +1,50 @@
+import asyncio
+
+from events import EventDispatcher, EventRouter
+
+GAME_START = {"type": "gameStart", "game": {"gameId": "abcd1234"}}
+
+
+class Lichess:
+    def __init__(self):
+        self.events = asyncio.Queue()
+        self.opened = 0
+
+    async def stream_incoming_events(self, token):
+        self.opened += 1
+        while True:
+            yield await self.events.get()
+
+
+def test_waiter_gets_its_event():
+    async def main():
+        lichess = Lichess()
+        dispatcher = EventDispatcher(lichess, "token")
+        dispatcher.start()
+        started = dispatcher.wait("gameStart", "abcd1234")
+        lichess.events.put_nowait(GAME_START)
+        assert await dispatcher.wait_for(started, 1) == GAME_START
+        assert not dispatcher.waiters
+        dispatcher.close()
+
+    asyncio.run(main())
+
+
+def test_idle_dispatcher_stops_and_is_forgotten():
+    async def main():
+        lichess = Lichess()
+        router = EventRouter(lichess, idle_timeout=0.05)
+        dispatcher = router.get(1, "token")
+        started = dispatcher.wait("gameStart", "abcd1234")
+        await asyncio.sleep(0.1)
+        assert not dispatcher.task.done()
+        dispatcher.discard(started)
+        await asyncio.sleep(0.1)
+        assert dispatcher.task.done()
+        assert 1 not in router.dispatchers
+        assert router.get(1, "token") is not dispatcher
+        await asyncio.sleep(0)
+        assert lichess.opened == 2
+        router.close()
+
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+from io import BytesIO
+
+import chess
+from PIL import Image, ImageChops
+
+from board import render_replay
+from gif import GifEncoder
+from renderer import get_renderer
+
+MOVES = "e4 e5 Nf3 Nc6 Bb5 a6 Ba4 Nf6 O-O Be7"
+
+
+def frames(gif: bytes) -> list[Image.Image]:
+    image = Image.open(BytesIO(gif))
+    result = []
+    for index in range(image.n_frames):
+        image.seek(index)
+        result.append(image.convert("RGB"))
+    return result
+
+
+def test_replay_has_a_frame_per_position():
+    assert len(frames(render_replay(MOVES))) == len(MOVES.split()) + 1
+
+
+def test_replay_last_frame_matches_direct_render():
+    board = chess.Board()
+    for move in MOVES.split():
+        board.push_san(move)
+    expected = get_renderer().render_frame(board).convert("RGB")
+    last = frames(render_replay(MOVES))[-1]
+    assert ImageChops.difference(last, expected).getbbox() is None
+
+
+def test_identical_frames_extend_previous_duration():
+    renderer = get_renderer()
+    board = chess.Board()
+    frame = renderer.render_frame(board)
+    gif = BytesIO()
+    encoder = GifEncoder(gif, renderer.palette, duration=100)
+    encoder.add_frame(frame)
+    encoder.add_frame(frame.copy())
+    board.push_san("e4")
+    encoder.add_frame(renderer.render_frame(board))
+    encoder.close()
+    image = Image.open(BytesIO(gif.getvalue()))
+    assert image.n_frames == 2
+    assert image.info["duration"] == 200
@@ -0,0 +1,40 @@
+from history import game_row
+
+
+def game(white: dict, black: dict, **fields) -> dict:
+    return {
+        "id": "abcd1234",
+        "createdAt": 1700000000000,
+        "status": "mate",
+        "players": {"white": white, "black": black},
+        "speed": "blitz",
+        "rated": True,
+        **fields,
+    }
+
+
+def user(name: str) -> dict:
+    return {"user": {"id": name.lower(), "name": name}}
+
+
+def test_draw_from_either_side():
+    draw = game(user("Alice"), user("Bob"), status="draw")
+    assert game_row("alice", draw)[3:6] == ("white", "Bob", "draw")
+    assert game_row("bob", draw)[3:6] == ("black", "Alice", "draw")
+
+
+def test_white_without_user_id():
+    ai = game({"aiLevel": 3}, user("Bob"), winner="black")
+    assert game_row("bob", ai)[3:6] == ("black", "AI lvl 3", "win")
+    anonymous = game({}, user("Bob"), winner="white")
+    assert game_row("bob", anonymous)[3:6] == ("black", "Anonymous", "loss")
+
+
+def test_black_without_user_id():
+    ai = game(user("Alice"), {"aiLevel": 8}, winner="black")
+    assert game_row("alice", ai)[3:6] == ("white", "AI lvl 8", "loss")
+
+
+def test_games_of_other_players_and_unplayed_games_are_skipped():
+    assert game_row("carol", game(user("Alice"), user("Bob"))) is None
+    assert game_row("alice", game(user("Alice"), user("Bob"), status="aborted")) is None
@@ -0,0 +1,48 @@
+import asyncio
+
+from fakeredis import FakeAsyncRedis
+
+from jobs import JobQueue
+from models.data import Job, JobWaiter
+
+JOB = Job(job_id="replay:abc", kind="replay", payload={"game_id": "abc"})
+
+
+def test_enqueue_joins_identical_job():
+    async def main():
+        queue = JobQueue(FakeAsyncRedis())
+        assert await queue.enqueue(JOB, JobWaiter(1, 10))
+        assert not await queue.enqueue(JOB, JobWaiter(2, 20))
+        job = await queue.claim("worker", timeout=0.1)
+        assert job.job_id == JOB.job_id and job.payload == JOB.payload
+        assert await queue.claim("worker", timeout=0.1) is None
+        # A message arriving while the job runs waits for the same result.
+        assert not await queue.enqueue(JOB, JobWaiter(3, 30))
+        waiters = await queue.finish("worker", job)
+        assert sorted(waiters, key=lambda waiter: waiter.message_id) == [
+            JobWaiter(1, 10),
+            JobWaiter(2, 20),
+            JobWaiter(3, 30),
+        ]
+        assert await queue.enqueue(JOB, JobWaiter(4, 40))
+
+    asyncio.run(main())
+
+
+def test_recover_requeues_jobs_of_stopped_workers():
+    async def main():
+        redis = FakeAsyncRedis()
+        queue = JobQueue(redis)
+        await queue.enqueue(JOB, JobWaiter(1, 10))
+        await queue.heartbeat("alive")
+        await queue.heartbeat("stopped")
+        await queue.claim("stopped", timeout=0.1)
+        assert await queue.recover() == 0
+        await redis.delete("jobs:worker:stopped")
+        assert await queue.recover() == 1
+        job = await queue.claim("alive", timeout=0.1)
+        assert job.job_id == JOB.job_id
+        assert job.attempts == 2
+        assert await queue.recover() == 0
+
+    asyncio.run(main())
@@ -0,0 +1,29 @@
+import chess
+
+from board import LiveBoard
+
+
+def test_update_applies_only_new_moves():
+    live_board = LiveBoard()
+    live_board.update("e2e4 e7e5")
+    board = live_board.update("e2e4 e7e5 g1f3")
+    assert board.move_stack == [
+        chess.Move.from_uci(m) for m in ("e2e4", "e7e5", "g1f3")
+    ]
+
+
+def test_update_rebuilds_after_takeback():
+    live_board = LiveBoard()
+    live_board.update("e2e4 e7e5 g1f3")
+    board = live_board.update("e2e4 e7e5 b1c3")
+    assert board.peek() == chess.Move.from_uci("b1c3")
+    assert len(board.move_stack) == 3
+
+
+def test_update_keeps_legal_prefix_of_broken_move_list():
+    live_board = LiveBoard()
+    live_board.update("e2e4")
+    board = live_board.update("e2e4 e7e5 e1e8 g1f3")
+    assert board.move_stack == [chess.Move.from_uci(m) for m in ("e2e4", "e7e5")]
+    board = live_board.update("e2e4 e7e5 g1f3")
+    assert board.peek() == chess.Move.from_uci("g1f3")
@@ -0,0 +1,29 @@
+import chess
+
+from positions import PositionIndex
+
+
+def test_repeated_position_counts_each_game_once(tmp_path):
+    index = PositionIndex(str(tmp_path))
+    index.add_games(
+        [
+            {"id": "repeat", "moves": "Nf3 Nf6 Ng1 Ng8 Nf3 d5", "winner": "white"},
+            {"id": "other", "moves": "e4 e5", "winner": None},
+        ]
+    )
+    result = index.lookup(chess.Board())
+    assert result["total"] == 2
+    assert sorted(result["moves"]) == [("Nf3", 1, 1, 0, 0), ("e4", 1, 0, 1, 0)]
+
+
+def test_lookup_sees_games_added_by_another_index(tmp_path):
+    reader = PositionIndex(str(tmp_path))
+    writer = PositionIndex(str(tmp_path))
+    writer.add_games([{"id": "a", "moves": "e4 c5", "winner": "black"}])
+    board = chess.Board()
+    board.push_san("e4")
+    assert reader.lookup(board) == {
+        "total": 1,
+        "games": ["a"],
+        "moves": [("c5", 1, 0, 0, 1)],
+    }
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from fakeredis import FakeAsyncRedis
+
+from ratelimit import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, RateLimiter
+
+
+def limiter(rate: float, burst: int) -> RateLimiter:
+    return RateLimiter(rate=rate, burst=burst, redis=FakeAsyncRedis())
+
+
+async def take(limiter: RateLimiter, priority: int, timeout: float = 0) -> bool:
+    return await limiter.acquire(None, priority, timeout)
+
+
+def test_rejects_when_bucket_is_empty():
+    async def main():
+        rate_limiter = limiter(rate=0.01, burst=2)
+        assert await take(rate_limiter, PRIORITY_HIGH)
+        assert await take(rate_limiter, PRIORITY_HIGH)
+        assert not await take(rate_limiter, PRIORITY_HIGH, timeout=0.1)
+
+    asyncio.run(main())
+
+
+def test_bucket_refills_over_time():
+    async def main():
+        rate_limiter = limiter(rate=20, burst=1)
+        assert await take(rate_limiter, PRIORITY_HIGH)
+        start = time.monotonic()
+        assert await take(rate_limiter, PRIORITY_HIGH, timeout=1)
+        assert 0.02 <= time.monotonic() - start < 1
+
+    asyncio.run(main())
+
+
+def test_lower_priorities_leave_a_reserve():
+    async def main():
+        rate_limiter = limiter(rate=0.01, burst=4)
+        # Low requests stop at half the bucket, normal ones at a quarter.
+        assert await take(rate_limiter, PRIORITY_LOW)
+        assert await take(rate_limiter, PRIORITY_LOW)
+        assert not await take(rate_limiter, PRIORITY_LOW)
+        assert await take(rate_limiter, PRIORITY_NORMAL)
+        assert not await take(rate_limiter, PRIORITY_NORMAL)
+        assert await take(rate_limiter, PRIORITY_HIGH)
+        assert not await take(rate_limiter, PRIORITY_HIGH)
+
+    asyncio.run(main())
+
+
+def test_token_bucket_limits_each_token():
+    async def main():
+        rate_limiter = RateLimiter(
+            rate=0.01, burst=10, token_rate=0.01, token_burst=1, redis=FakeAsyncRedis()
+        )
+        assert await rate_limiter.acquire("a", PRIORITY_HIGH, 0)
+        assert not await rate_limiter.acquire("a", PRIORITY_HIGH, 0)
+        assert await rate_limiter.acquire("b", PRIORITY_HIGH, 0)
+
+    asyncio.run(main())
+
+
+def test_block_stops_all_requests():
+    async def main():
+        rate_limiter = limiter(rate=10, burst=10)
+        await rate_limiter.block(5)
+        assert not await take(rate_limiter, PRIORITY_HIGH, timeout=1)
+
+    asyncio.run(main())
@@ -0,0 +1,270 @@
+import asyncio
+import os
+import socket
+import uuid
+
+import discord
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import store
+from board import replay_message, replay_players
+from engine import (
+    ENGINE_DEPTH,
+    EnginePool,
+    EngineUnavailable,
+    format_score,
+    game_boards,
+    summarize,
+)
+from history import HistoryStore
+from jobs import JOB_LEASE_TTL, JOB_MAX_ATTEMPTS, JobQueue
+from lichess import LichessClient, LichessError, RateLimited
+from models.data import Job, JobWaiter
+from positions import PositionIndex
+from render_service import RenderService
+from replay_cache import ReplayCache
+
+TOKEN = os.getenv("DISCORD_TOKEN")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+
+
+class JobFailed(Exception):
+    def __init__(self, title: str, description: str):
+        super().__init__(description)
+        self.title = title
+        self.description = description
+
+
+class Worker:
+    """
+    Runs queued jobs and edits the waiting Discord messages with the result.
+
+    The worker only talks to Discord over HTTP, it does not connect to the
+    gateway.
+    """
+
+    def __init__(self, concurrency: int = JOB_WORKERS):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.concurrency = concurrency
+        self.queue = JobQueue()
+        self.client = discord.Client(intents=discord.Intents.none())
+        self.lichess = LichessClient()
+        self.render_service = RenderService()
+        self.replay_cache = ReplayCache()
+        self.history = HistoryStore()
+        self.positions = PositionIndex()
+        self.engines = EnginePool()
+        self.handlers = {
+            "replay": self.replay,
+            "analysis": self.analyze,
+            "history": self.import_history,
+        }
+
+    async def export(self, token: str, game_id: str) -> dict:
+        """
+        Fetch a game from the replay cache or Lichess, indexing its
+        positions the first time a finished game is exported.
+        """
+        try:
+            game = await self.replay_cache.get_game(game_id)
+            if game is None:
+                game = await self.lichess.export_game(token, game_id)
+                await self.replay_cache.set_game(game_id, game)
+        except RateLimited:
+            raise JobFailed(
+                "Lichess Is Busy",
+                "Too many requests were sent to Lichess. Please try again in a minute.",
+            )
+        except LichessError:
+            raise JobFailed("Error Fetching Game", "Invalid game ID provided.")
+        if self.replay_cache.is_finished(game):
+            await asyncio.to_thread(self.positions.add_games, [game])
+        return game
+
+    async def replay(self, job: Job, waiters: list[JobWaiter]) -> None:
+        game_id = job.payload["game_id"]
+        auth = await store.get_auth(job.payload["user_id"])
+        if auth is None:
+            raise JobFailed("Not Logged In", "Please use `/login` again.")
+        await self.show(
+            waiters,
+            embed=discord.Embed(
+                title="Rendering Replay",
+                description=f"Rendering game {game_id}...",
+                color=discord.Color.blue(),
+            ),
+        )
+        game = await self.export(auth.token, game_id)
+        gif = await self.replay_cache.get_replay(game_id)
+        if gif is None:
+            try:
+                gif = await self.render_service.render_replay(game["moves"])
+            except asyncio.TimeoutError:
+                raise JobFailed(
+                    "Renderer Busy",
+                    "Too many replays are being rendered. Please try again later.",
+                )
+            await self.replay_cache.set_replay(game_id, game, gif)
+        for waiter in await self.queue.finish(self.worker_id, job):
+            embed, image = replay_message(gif)
+            embed.set_footer(text=replay_players(game))
+            await self.edit(waiter, embed=embed, attachments=[image])
+
+    async def analyze(self, job: Job, waiters: list[JobWaiter]) -> None:
+        game_id = job.payload["game_id"]
+        auth = await store.get_auth(job.payload["user_id"])
+        if auth is None:
+            raise JobFailed("Not Logged In", "Please use `/login` again.")
+        if not self.engines.available:
+            raise JobFailed(
+                "Engine Unavailable",
+                "No chess engine is running. Please try again later.",
+            )
+        await self.show(
+            waiters,
+            embed=discord.Embed(
+                title="Analyzing Game",
+                description=f"Analyzing game {game_id}...",
+                color=discord.Color.blue(),
+            ),
+        )
+        game = await self.export(auth.token, game_id)
+        try:
+            boards, moves = game_boards(game)
+        except ValueError as e:
+            raise JobFailed("Cannot Analyze Game", str(e))
+        try:
+            evaluations = await self.engines.analyze(boards)
+        except EngineUnavailable:
+            raise JobFailed(
+                "Engine Unavailable", "The chess engine failed. Please try again later."
+            )
+        summary = summarize(boards, moves, evaluations)
+        embed = discord.Embed(
+            title=f"Analysis of {replay_players(game)}",
+            url=f"https://lichess.org/{game_id}",
+            description=f"**Final Evaluation:** {format_score(evaluations[-1].score)}",
+            color=discord.Color.green(),
+        )
+        for color in ("white", "black"):
+            stats = summary[color]
+            embed.add_field(
+                name=color.capitalize(),
+                value=(
+                    f"**Average Centipawn Loss:** {stats['acpl']}\n"
+                    f"**Inaccuracies:** {stats['inaccuracies']}\n"
+                    f"**Mistakes:** {stats['mistakes']}\n"
+                    f"**Blunders:** {stats['blunders']}"
+                ),
+            )
+        embed.add_field(
+            name="Worst Moves",
+            value="\n".join(
+                f"{label} ({format_score(before)} → {format_score(after)})"
+                + (f", best was {best}" if best else "")
+                for _, label, before, after, best in summary["worst"]
+            )
+            or "None",
+            inline=False,
+        )
+        embed.set_footer(text=f"Depth {ENGINE_DEPTH}")
+        for waiter in await self.queue.finish(self.worker_id, job):
+            await self.edit(waiter, embed=embed)
+
+    async def import_history(self, job: Job, waiters: list[JobWaiter]) -> None:
+        username = job.payload["username"]
+        auth = await store.get_auth(job.payload["user_id"])
+        if auth is None:
+            raise JobFailed("Not Logged In", "Please use `/login` again.")
+        await self.show(
+            waiters,
+            embed=discord.Embed(
+                title="Importing Games",
+                description=f"Importing the games of {username}...",
+                color=discord.Color.blue(),
+            ),
+        )
+        try:
+            stored = await self.history.ingest(self.lichess, auth.token, username)
+        except RateLimited:
+            raise JobFailed(
+                "Lichess Is Busy",
+                "Too many requests were sent to Lichess. Please try again in a minute.",
+            )
+        embed = discord.Embed(
+            title="Games Imported",
+            description=f"Imported {stored} new games of {username}. Use `/stats` to explore them.",
+            color=discord.Color.green(),
+        )
+        for waiter in await self.queue.finish(self.worker_id, job):
+            await self.edit(waiter, embed=embed)
+
+    async def edit(self, waiter: JobWaiter, **kwargs) -> None:
+        message = self.client.get_partial_messageable(
+            waiter.channel_id
+        ).get_partial_message(waiter.message_id)
+        try:
+            await message.edit(**kwargs)
+        except discord.HTTPException as e:
+            print(f"Could not edit message {waiter.message_id}: {e}")
+
+    async def show(self, waiters: list[JobWaiter], embed: discord.Embed) -> None:
+        await asyncio.gather(*[self.edit(waiter, embed=embed) for waiter in waiters])
+
+    async def run_job(self, job: Job) -> None:
+        try:
+            if job.attempts > JOB_MAX_ATTEMPTS:
+                raise JobFailed("Job Failed", "This job failed too many times.")
+            await self.handlers[job.kind](job, await self.queue.waiters(job.job_id))
+            return
+        except JobFailed as e:
+            embed = discord.Embed(
+                title=e.title, description=e.description, color=discord.Color.red()
+            )
+        except Exception as e:
+            print(f"Job {job.job_id} failed: {e!r}")
+            embed = discord.Embed(
+                title="Job Failed",
+                description="Something went wrong. Please try again later.",
+                color=discord.Color.red(),
+            )
+        for waiter in await self.queue.finish(self.worker_id, job):
+            await self.edit(waiter, embed=embed)
+
+    async def heartbeat(self) -> None:
+        while True:
+            await self.queue.heartbeat(self.worker_id)
+            requeued = await self.queue.recover()
+            if requeued:
+                print(f"Requeued {requeued} jobs of stopped workers")
+            await asyncio.sleep(JOB_LEASE_TTL / 3)
+
+    async def consume(self) -> None:
+        while True:
+            job = await self.queue.claim(self.worker_id, JOB_LEASE_TTL / 3)
+            if job is not None:
+                await self.run_job(job)
+
+    async def run(self) -> None:
+        await self.client.login(TOKEN)
+        await self.lichess.start()
+        self.render_service.start()
+        await self.engines.start()
+        await self.queue.heartbeat(self.worker_id)
+        try:
+            await asyncio.gather(
+                self.heartbeat(),
+                *[self.consume() for _ in range(self.concurrency)],
+            )
+        finally:
+            self.render_service.close()
+            await self.engines.close()
+            await self.lichess.close()
+            await self.client.close()
+            await store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(Worker().run())